@@ -34,6 +34,39 @@ dotenv.load_dotenv(BASE_DIR / ".env")
 CLIENT_ID = os.environ.get("client_id", "")
 CLIENT_SECRET = os.environ.get("client_secret", "")
 USER_AGENT = os.environ.get("user_agent", "")
+# Where the Reddit API lives, pointed elsewhere by e.g. `manage.py bench_sync`.
+REDDIT_URL = os.environ.get("reddit_url", "https://www.reddit.com")
+REDDIT_OAUTH_URL = os.environ.get("reddit_oauth_url", "https://oauth.reddit.com")
+
+# Sync engine: how many listings are fetched at once, how many threads write
+# them to the database, and the request budget shared by every fetch thread.
+SYNC_CONCURRENCY = int(os.environ.get("sync_concurrency", 8))
+SYNC_WRITERS = int(os.environ.get("sync_writers", 2))
+REDDIT_REQUESTS_PER_MINUTE = int(os.environ.get("reddit_requests_per_minute", 90))
+# Runs over at least this many subreddits load every stored post id up front,
+# smaller ones, like a single subreddit's job, look ids up page by page.
+SYNC_PRELOAD_KNOWN_SUBREDDITS = int(os.environ.get("sync_preload_known_subreddits", 20))
+# Scheduling: a subreddit is synced once this many new posts are expected from
+# its post rate, and at least every this many hours however quiet it is.
+SYNC_MIN_EXPECTED_POSTS = float(os.environ.get("sync_min_expected_posts", 1))
+SYNC_MAX_INTERVAL_HOURS = float(os.environ.get("sync_max_interval_hours", 24))
+
+# Image validation: HEAD requests in flight at once, and per image host.
+VALIDATION_WORKERS = int(os.environ.get("validation_workers", 32))
+VALIDATION_PER_HOST = int(os.environ.get("validation_per_host", 8))
+# Seconds a stored HEAD result stays valid, 0 turns the cache off.
+VALIDATION_CACHE_TTL = int(os.environ.get("validation_cache_ttl", 7 * 24 * 3600))
+
+# Gallery cards load the smallest preview at least this many pixels wide.
+CARD_IMAGE_WIDTH = int(os.environ.get("card_image_width", 320))
+# Cards per gallery page, the next ones load while scrolling.
+GALLERY_PAGE_SIZE = int(os.environ.get("gallery_page_size", 200))
+# Local card thumbnails: where they're kept, their format (webp or jpeg), the
+# size cap of the directory, and whether the sync worker makes them after a job.
+THUMBNAIL_DIR = BASE_DIR / os.environ.get("thumbnail_dir", "data/thumbnails")
+THUMBNAIL_FORMAT = os.environ.get("thumbnail_format", "webp")
+THUMBNAIL_CACHE_MB = int(os.environ.get("thumbnail_cache_mb", 512))
+THUMBNAILS_AFTER_SYNC = os.environ.get("thumbnails_after_sync", "1") == "1"
 
 # DOWNLOAD_PATH = BASE_DIR / "downloads"
 # if not DOWNLOAD_PATH.exists():
@@ -124,6 +157,22 @@ DATABASES = {
     }
 }
 
+# Rendered gallery pages, card pages and image API lists are cached until a
+# sync writes new images, see `gallery/caching.py`. The cache has to be shared
+# by the web and worker processes for the writes to invalidate it, like the
+# file cache in `data/cache` the containers both mount.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'cache_backend', 'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': str(BASE_DIR / os.environ.get('cache_location', 'data/cache')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('cache_max_entries', 10000)),
+        },
+    }
+}
+RESPONSE_CACHE_SECONDS = int(os.environ.get("response_cache_seconds", 24 * 3600))
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
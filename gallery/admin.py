@@ -1,3 +1,11 @@
 from django.contrib import admin
 
+from .models import RedditCredential
+
 # Register your models here.
+
+
+@admin.register(RedditCredential)
+class RedditCredentialAdmin(admin.ModelAdmin):
+    list_display = ("name", "client_id", "is_active", "added_on")
+    list_filter = ("is_active",)
@@ -3,7 +3,8 @@ from rest_framework.decorators import action
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.routers import DefaultRouter
 from rest_framework.serializers import Serializer
-from gallery.models import Category, SubReddit, Image, SavedImages
+from gallery.caching import FOLDERS, IMAGES, cached_response
+from gallery.models import Category, SubReddit, Image, ImageCounter, SavedImages
 from gallery.serializers import CategorySerializer, ImageSerializer, SubRedditSerializer
 
 from datetime import datetime as dt
@@ -44,12 +45,36 @@ class ImageViewSet(ModelViewSet):
     queryset = Image.objects.all()
     serializer_class = ImageSerializer
 
+    def get_queryset(self):
+        # Nested subreddits, galleries and the deleted flag come with the
+        # images instead of a query per row.
+        return Image.annotate_deleted(
+            super().get_queryset().select_related("subreddit", "gallery__subreddit")
+        )
+
+    # Updates recount their subreddits, which also drops the cached pages and
+    # lists that show them. Deletes are recounted by `signals.image_deleted`.
+    def perform_update(self, serializer):
+        subreddit_id = serializer.instance.subreddit_id
+        image = serializer.save()
+        ImageCounter.recount({subreddit_id, image.subreddit_id} - {None})
+
     def list(self, request, *args, **kwargs):
+        # The browsable API holds a CSRF token, only JSON is shared.
+        if request.accepted_renderer.format != "json":
+            return self.image_list(request)
+        return cached_response(
+            request, [IMAGES, FOLDERS], lambda: self.image_list(request)
+        )
+
+    def image_list(self, request):
+        queryset = self.get_queryset()
         if (category := self.request.GET.get("category", "")) != "":
             subreddits = SubReddit.objects.filter(categories__name=category)
-            self.queryset = self.queryset.filter(subreddit__in=subreddits)
-        self.queryset = self.queryset.order_by("-date_added")[:2000]
-        return super().list(request, *args, **kwargs)
+            queryset = queryset.filter(subreddit__in=subreddits)
+        queryset = queryset.order_by("-date_added")[:2000]
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
 
     @action(detail=True, methods=['get', 'head'])
     def download_image(self):
@@ -0,0 +1,98 @@
+"""
+Cache versions and the response cache.
+Cached fragments and responses put the version numbers of what they show in
+their key, and a change to it bumps the version instead of deleting keys one
+by one. The old entries are never read again and expire on their own.
+Versions live in the cache itself, so with a shared backend (the file cache in
+the settings) a sync in the worker process invalidates the web pages.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+# Subreddits, categories and who belongs to them.
+FOLDERS = "folders"
+# Any subreddit's images.
+IMAGES = "images"
+
+
+def subreddit_scope(pk) -> str:
+    """One subreddit's images."""
+    return f"subreddit:{pk}"
+
+
+def version_key(scope: str) -> str:
+    return f"version:{scope}"
+
+
+def get_version(scope: str) -> int:
+    """Current version of a scope, started if the cache doesn't have one."""
+    return get_versions([scope])[0]
+
+
+def get_versions(scopes: list) -> list:
+    keys = [version_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return [found[key] for key in keys]
+
+
+def bump_versions(scopes):
+    # Versions come from the clock rather than a counter: a version lost to
+    # eviction never comes back, and two processes bumping at once can't
+    # both land on the same number.
+    now = time.time_ns()
+    cache.set_many({version_key(scope): now for scope in scopes}, None)
+
+
+def bump_version(scope: str):
+    bump_versions([scope])
+
+
+def cached_response(request, scopes: list, respond, per_user: bool = False):
+    """
+    Serves a GET from the cache, or caches the response `respond()` returns.
+    :param scopes: Version scopes the response shows.
+    :param respond: Builds the response on a miss.
+    :param per_user: The page holds a CSRF token, it's only cached for a
+        client that has the CSRF cookie, under a key of its own.
+    """
+    if request.method != "GET":
+        return respond()
+    parts = [request.get_full_path(), request.META.get("HTTP_ACCEPT", "")]
+    if per_user:
+        token = request.COOKIES.get(settings.CSRF_COOKIE_NAME)
+        if not token:
+            return respond()
+        parts.append(token)
+    parts += [str(version) for version in get_versions(scopes)]
+    key = "response:" + hashlib.sha256("|".join(parts).encode()).hexdigest()
+    hit = cache.get(key)
+    if hit is not None:
+        status, content, headers = hit
+        response = HttpResponse(content, status=status)
+        for name, value in headers:
+            response[name] = value
+        return response
+
+    def store(response):
+        if response.status_code == 200 and not response.streaming:
+            cache.set(
+                key,
+                (response.status_code, response.content, list(response.items())),
+                settings.RESPONSE_CACHE_SECONDS,
+            )
+
+    response = respond()
+    if getattr(response, "is_rendered", True):
+        store(response)
+    else:
+        response.add_post_render_callback(store)
+    return response
@@ -0,0 +1,193 @@
+"""
+Reddit client pool.
+Every registered app (the `client_id` in the settings plus each active
+`RedditCredential`) has its own quota: a local request budget and the
+remaining requests Reddit reports in the `x-ratelimit-*` headers of its
+responses. Each request goes through the app with the most headroom, so a sync
+gets the combined rate limit of all of them.
+PRAW isn't thread safe, so every thread builds its own client per app.
+"""
+
+import threading
+import time
+
+import praw
+import prawcore
+from django.conf import settings
+
+from .ratelimit import RateLimiter
+from .telemetry import record
+
+# Requests Reddit allows an app per rate limit window, assumed until the
+# first response of a window says otherwise.
+DEFAULT_QUOTA = 1000
+
+
+class Quota:
+    """Request budget and last reported rate limit of one app."""
+
+    def __init__(
+        self, client_id: str, client_secret: str, user_agent: str, per_minute: int
+    ):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.user_agent = user_agent
+        self.bucket = RateLimiter(per_minute)
+        self.remaining = None
+        self.reset_at = None
+        self.used = 0
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return f"{self.client_id} - {self.headroom():.0f} left"
+
+    def headroom(self, now: float = None) -> float:
+        now = now or time.monotonic()
+        with self.lock:
+            if self.remaining is None or self.reset_at is None or now >= self.reset_at:
+                remaining = DEFAULT_QUOTA
+            else:
+                remaining = self.remaining
+            return remaining - self.in_flight
+
+    def acquire(self):
+        """Blocks until the app may make a request, waiting out an empty window."""
+        self.bucket.acquire()
+        with self.lock:
+            self.in_flight += 1
+            now = time.monotonic()
+            wait = 0
+            if self.remaining is not None and self.remaining < 1 and self.reset_at:
+                wait = max(self.reset_at - now, 0)
+        if wait:
+            time.sleep(wait)
+
+    def release(self, response=None):
+        """Takes the app's rate limit from a response's headers."""
+        with self.lock:
+            self.in_flight -= 1
+            if response is None:
+                return
+            headers = response.headers
+            try:
+                remaining = float(headers["x-ratelimit-remaining"])
+                reset = float(headers["x-ratelimit-reset"])
+                used = int(float(headers.get("x-ratelimit-used", 0)))
+            except (KeyError, ValueError):
+                return
+            self.remaining = remaining
+            self.reset_at = time.monotonic() + reset
+            self.used = used
+
+
+class QuotaRequestor(prawcore.Requestor):
+    """Requestor that goes through its app's `Quota` for every request."""
+
+    def __init__(self, *args, quota: Quota = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.quota = quota
+
+    def request(self, *args, **kwargs):
+        self.quota.acquire()
+        record("api_calls")
+        response = None
+        try:
+            response = super().request(*args, **kwargs)
+            return response
+        finally:
+            self.quota.release(response)
+
+
+def build_client(quota: Quota) -> praw.Reddit:
+    return praw.Reddit(
+        client_id=quota.client_id,
+        client_secret=quota.client_secret,
+        user_agent=quota.user_agent,
+        reddit_url=settings.REDDIT_URL,
+        oauth_url=settings.REDDIT_OAUTH_URL,
+        requestor_class=QuotaRequestor,
+        requestor_kwargs={"quota": quota},
+    )
+
+
+class ClientPool:
+    def __init__(self):
+        self.per_minute = settings.REDDIT_REQUESTS_PER_MINUTE
+        self.quotas = {}
+        self.loaded = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def credentials(self) -> list:
+        """Returns (client_id, client_secret, user_agent) of every app to use."""
+        from .models import RedditCredential
+
+        found = {}
+        if settings.CLIENT_ID:
+            found[settings.CLIENT_ID] = (
+                settings.CLIENT_ID,
+                settings.CLIENT_SECRET,
+                settings.USER_AGENT,
+            )
+        for credential in RedditCredential.objects.filter(is_active=True).order_by("id"):
+            found.setdefault(
+                credential.client_id,
+                (
+                    credential.client_id,
+                    credential.client_secret,
+                    credential.user_agent or settings.USER_AGENT,
+                ),
+            )
+        if not found:
+            # Nothing registered, let PRAW complain like it always did.
+            found[""] = (settings.CLIENT_ID, settings.CLIENT_SECRET, settings.USER_AGENT)
+        return list(found.values())
+
+    def load(self):
+        """
+        Reads the registered apps again, apps that stay keep their quota.
+        Threads build new clients on their next request.
+        """
+        credentials = self.credentials()
+        with self.lock:
+            quotas = {}
+            for client_id, client_secret, user_agent in credentials:
+                quota = self.quotas.get(client_id)
+                if (
+                    quota is None
+                    or quota.client_secret != client_secret
+                    or quota.user_agent != user_agent
+                ):
+                    quota = Quota(client_id, client_secret, user_agent, self.per_minute)
+                quotas[client_id] = quota
+            self.quotas = quotas
+            self.loaded = True
+
+    def set_per_minute(self, per_minute: int):
+        """Sets every app's local budget, e.g. to a worker process's share."""
+        with self.lock:
+            self.per_minute = per_minute
+            for quota in self.quotas.values():
+                quota.bucket = RateLimiter(per_minute)
+
+    def pick(self) -> Quota:
+        """Returns the app with the most headroom."""
+        if not self.loaded:
+            self.load()
+        now = time.monotonic()
+        with self.lock:
+            quotas = list(self.quotas.values())
+        return max(quotas, key=lambda quota: quota.headroom(now))
+
+    def client(self) -> praw.Reddit:
+        """Returns the current thread's client of the app with the most headroom."""
+        quota = self.pick()
+        clients = getattr(self.local, "clients", None)
+        if clients is None:
+            clients = self.local.clients = {}
+        # Keyed by the quota itself, a reloaded app gets a new client.
+        client = clients.get(quota)
+        if client is None:
+            client = clients[quota] = build_client(quota)
+        return client
@@ -0,0 +1,418 @@
+"""
+Concurrent sync engine.
+Every (subreddit, time frame, listing type) is fetched as its own task on a
+thread pool, all of them sharing the Reddit apps of `utils.client_pool`. Each
+fetched page is handed on through bounded queues to be cleaned and validated,
+then to a small pool of writers, so a full sync takes about as long as its
+slowest subreddits instead of the sum of all of them, and never holds more
+than a few pages.
+The listings of a subreddit overlap heavily, so each post id is only handed to
+the writer by the first listing of the run that returns it. Runs over many
+subreddits check posts against a `KnownPosts` set loaded once for the whole
+run, smaller ones ask the database page by page.
+"""
+
+import asyncio
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .membership import KnownPosts
+from .models import ListingCursor, SubReddit, SyncJob, reset_connection_pool
+from .telemetry import ListingStats
+from .utils import (
+    LIMIT,
+    client_pool,
+    commit_posts,
+    get_listings,
+    get_subreddit_about,
+    iter_listing_pages,
+    prepare_posts,
+)
+
+
+def load_cursors(subreddits: list) -> dict:
+    """Returns the high-water marks of the given subreddits keyed by listing."""
+    return {
+        (cursor.subreddit_id, cursor.listing, cursor.time_frame): cursor
+        for cursor in ListingCursor.objects.filter(subreddit__in=subreddits)
+    }
+
+
+def advance_cursor(subreddit: SubReddit, listing: str, time_frame: str, posts: list):
+    """Moves the listing's high-water mark to the newest of the written posts."""
+    newest = max(
+        (post for post in posts if post.get("created")),
+        key=lambda post: post["created"],
+        default=None,
+    )
+    if newest is None:
+        return
+    cursor, _ = ListingCursor.objects.get_or_create(
+        subreddit=subreddit, listing=listing, time_frame=time_frame
+    )
+    if cursor.newest_created is None or newest["created"] > cursor.newest_created:
+        cursor.newest_created = newest["created"]
+        cursor.newest_reddit_id = newest["id"]
+        cursor.save()
+
+
+def save_subreddit_info(subreddit: SubReddit, info: dict):
+    try:
+        subreddit.display_name = info["title_sub"]
+        subreddit.name = info["display_name"]
+        subreddit.save(update_fields=["display_name", "name"])
+    except Exception:
+        pass
+    finally:
+        reset_connection_pool()
+
+
+def prepare_page(posts: list, known: KnownPosts = None) -> list:
+    """Cleans and validates one page, runs on a prepare thread."""
+    try:
+        return prepare_posts(posts, known)
+    finally:
+        reset_connection_pool()
+
+
+def commit_page(subreddit: SubReddit, prepared: list, known: KnownPosts = None):
+    """Writes one prepared page, runs on a writer thread."""
+    try:
+        commit_posts(prepared, subreddit, known)
+    finally:
+        reset_connection_pool()
+
+
+def finish_listing(state: dict, advance: bool = True):
+    """
+    Moves the listing's high-water mark if every page made it, and records its
+    `SyncRun` unless the time budget ran out before it started.
+    :param advance: False keeps the mark where it is, e.g. because a sibling
+        listing failed to write posts this one skipped as duplicates.
+    """
+    try:
+        if state["skipped"]:
+            return
+        if (
+            advance
+            and not state["failed"]
+            and not state["cut"]
+            and state["newest"] is not None
+        ):
+            state["stats"].run(
+                "commit",
+                advance_cursor,
+                state["subreddit"],
+                state["listing"],
+                state["time_frame"],
+                [state["newest"]],
+            )
+        state["stats"].save()
+    finally:
+        reset_connection_pool()
+
+
+def finish_subreddit(subreddit: SubReddit, new_posts: int):
+    try:
+        subreddit.record_sync(new_posts)
+    finally:
+        reset_connection_pool()
+
+
+async def sync_subreddits(
+    subreddits: list,
+    cursors: dict,
+    known: KnownPosts | None,
+    concurrency: int,
+    writers: int,
+    on_subreddit_done=None,
+    job: SyncJob = None,
+    deadline: float = None,
+) -> Counter:
+    """
+    Streams every listing of the given subreddits through three stages, fetch,
+    prepare (clean and validate) and commit, one page at a time.
+    The queues between the stages are bounded, a listing only requests its next
+    page once the last one has been queued, so the pages in flight stay the
+    same however long the listings are and the first write follows the first page.
+    Once `deadline` (`time.monotonic()`) passes, listings stop requesting pages,
+    what they fetched is still written. Subreddits are started in the given order.
+    """
+    loop = asyncio.get_running_loop()
+    stats = Counter()
+    listings = list(get_listings())
+    # Listings of each subreddit that haven't been written yet.
+    remaining = {subreddit.id: 0 for subreddit in subreddits}
+    for subreddit in subreddits:
+        remaining[subreddit.id] += len(listings)
+    # Post ids handed to the writer so far, per subreddit. Only touched from
+    # the event loop, so it needs no lock.
+    seen = {subreddit.id: set() for subreddit in subreddits}
+    # New posts per subreddit, and whether all of its listings ran to the end.
+    new_posts = {subreddit.id: 0 for subreddit in subreddits}
+    complete = {subreddit.id: True for subreddit in subreddits}
+    # Settled listings of each subreddit. Their cursors only move once all of
+    # them are written, a post the other listings skipped as a duplicate may
+    # be in the page of one that failed.
+    settled = {subreddit.id: [] for subreddit in subreddits}
+    # About info of each subreddit, fetched by its first listing and shared.
+    abouts = {}
+    fetch_pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="fetch")
+    prepare_pool = ThreadPoolExecutor(
+        max_workers=concurrency, thread_name_prefix="prepare"
+    )
+    write_pool = ThreadPoolExecutor(max_workers=writers, thread_name_prefix="write")
+    prepare_queue = asyncio.Queue(maxsize=concurrency)
+    commit_queue = asyncio.Queue(maxsize=writers * 2)
+
+    def out_of_time():
+        return deadline is not None and time.monotonic() >= deadline
+
+    async def listing_done(state):
+        subreddit = state["subreddit"]
+        settled[subreddit.id].append(state)
+        remaining[subreddit.id] -= 1
+        if remaining[subreddit.id] == 0:
+            stats["subreddits_done"] += 1
+            states = settled.pop(subreddit.id)
+            advance = not any(listing["failed"] for listing in states)
+            for listing in states:
+                try:
+                    await loop.run_in_executor(
+                        write_pool, finish_listing, listing, advance
+                    )
+                except Exception as E:
+                    print(f"Error finishing {subreddit.sub_reddit}: {E}")
+            if complete[subreddit.id]:
+                await loop.run_in_executor(
+                    write_pool, finish_subreddit, subreddit, new_posts[subreddit.id]
+                )
+            if on_subreddit_done is not None:
+                await loop.run_in_executor(write_pool, on_subreddit_done, subreddit)
+
+    async def page_done(state):
+        """
+        Settles a listing once it is fetched and all of its pages are written.
+        """
+        if not state["fetched"] or state["pending"] or state["settled"]:
+            return
+        state["settled"] = True
+        subreddit = state["subreddit"]
+        new_posts[subreddit.id] += state["stats"].counts["posts_new"]
+        if state["failed"] or state["cut"]:
+            complete[subreddit.id] = False
+        await listing_done(state)
+
+    async def update_about(subreddit, listing_stats):
+        """Fetches and saves a subreddit's about info, once per run."""
+        info = await loop.run_in_executor(
+            fetch_pool,
+            listing_stats.run,
+            "fetch",
+            get_subreddit_about,
+            subreddit.sub_reddit,
+        )
+        await loop.run_in_executor(
+            write_pool,
+            listing_stats.run,
+            "commit",
+            save_subreddit_info,
+            subreddit,
+            info,
+        )
+
+    async def fetch(subreddit, time_, type_of):
+        cursor = cursors.get((subreddit.id, type_of, time_))
+        state = {
+            "subreddit": subreddit,
+            "listing": type_of,
+            "time_frame": time_,
+            "newest": None,
+            "pending": 0,
+            "fetched": False,
+            "failed": False,
+            "settled": False,
+            "cut": False,
+            "skipped": False,
+            "stats": ListingStats(subreddit, type_of, time_, job),
+        }
+        listing_stats = state["stats"]
+        try:
+            if out_of_time():
+                stats["listings_skipped"] += 1
+                state["cut"] = state["skipped"] = True
+                return
+            # The first listing of the subreddit fetches it, the others wait.
+            if subreddit.id not in abouts:
+                abouts[subreddit.id] = asyncio.ensure_future(
+                    update_about(subreddit, listing_stats)
+                )
+            await abouts[subreddit.id]
+            pages = iter_listing_pages(
+                subreddit.sub_reddit,
+                time_,
+                type_of,
+                LIMIT,
+                since=cursor.newest_created if cursor else None,
+            )
+            while True:
+                if out_of_time():
+                    stats["listings_cut"] += 1
+                    state["cut"] = True
+                    break
+                page = await loop.run_in_executor(
+                    fetch_pool, listing_stats.run, "fetch", next, pages, None
+                )
+                if page is None:
+                    break
+                stats["posts_fetched"] += len(page)
+                stats["pages_fetched"] += 1
+                listing_stats.add("pages_fetched")
+                listing_stats.add("posts_seen", len(page))
+                unique = []
+                for post in page:
+                    newest = state["newest"]
+                    if newest is None or post["created"] > newest["created"]:
+                        state["newest"] = post
+                    if post["id"] in seen[subreddit.id]:
+                        stats["duplicates_skipped"] += 1
+                        continue
+                    seen[subreddit.id].add(post["id"])
+                    unique.append(post)
+                if not unique:
+                    continue
+                state["pending"] += 1
+                await prepare_queue.put((state, unique))
+            print("processed subreddit: ", subreddit.sub_reddit, time_, type_of)
+        except Exception as E:
+            print(f"Error fetching {subreddit.sub_reddit} {time_} {type_of}: {E}")
+            listing_stats.error(E)
+            state["failed"] = True
+        finally:
+            state["fetched"] = True
+            await page_done(state)
+
+    async def prepare():
+        while True:
+            state, posts = await prepare_queue.get()
+            try:
+                prepared = await loop.run_in_executor(
+                    prepare_pool,
+                    state["stats"].run,
+                    "prepare",
+                    prepare_page,
+                    posts,
+                    known,
+                )
+                await commit_queue.put((state, prepared))
+            except Exception as E:
+                print(f"Error preparing {state['subreddit'].sub_reddit}: {E}")
+                state["stats"].error(E)
+                state["failed"] = True
+                state["pending"] -= 1
+                await page_done(state)
+            finally:
+                prepare_queue.task_done()
+
+    async def commit():
+        while True:
+            state, prepared = await commit_queue.get()
+            try:
+                await loop.run_in_executor(
+                    write_pool,
+                    state["stats"].run,
+                    "commit",
+                    commit_page,
+                    state["subreddit"],
+                    prepared,
+                    known,
+                )
+            except Exception as E:
+                print(f"Error writing {state['subreddit'].sub_reddit}: {E}")
+                state["stats"].error(E)
+                state["failed"] = True
+            try:
+                state["pending"] -= 1
+                # Before task_done, the run ends once the queue is joined.
+                await page_done(state)
+            finally:
+                commit_queue.task_done()
+
+    workers = [asyncio.create_task(prepare()) for _ in range(concurrency)]
+    workers += [asyncio.create_task(commit()) for _ in range(writers)]
+    try:
+        await asyncio.gather(
+            *(
+                fetch(subreddit, time_, type_of)
+                for subreddit in subreddits
+                for time_, type_of in listings
+            )
+        )
+        await prepare_queue.join()
+        await commit_queue.join()
+    finally:
+        for task in workers:
+            task.cancel()
+        fetch_pool.shutdown(wait=True)
+        prepare_pool.shutdown(wait=True)
+        write_pool.shutdown(wait=True)
+    return stats
+
+
+def run_sync(
+    subreddits,
+    concurrency: int = None,
+    writers: int = None,
+    on_subreddit_done=None,
+    job: SyncJob = None,
+    budget: float = None,
+) -> Counter:
+    """
+    Syncs the given subreddits concurrently.
+    :param subreddits: SubReddit objects or a queryset of them.
+    :param concurrency: Listings fetched at once, defaults to `SYNC_CONCURRENCY`.
+    :param writers: Threads writing to the database, defaults to `SYNC_WRITERS`.
+    :param on_subreddit_done: Called on a writer thread with each subreddit once
+        all of its listings are written.
+    :param job: SyncJob the run belongs to, linked from its `SyncRun` rows.
+    :param budget: Seconds the run may take, listings stop paging once it's
+        spent and subreddits that haven't started are left for the next run.
+    :return: Counters of the run, e.g. posts fetched and duplicates skipped.
+    """
+    # Querysets can't be evaluated inside the event loop.
+    subreddits = list(subreddits)
+    if not subreddits:
+        return Counter()
+    deadline = time.monotonic() + budget if budget else None
+    # Picks up apps registered since the last run.
+    client_pool.load()
+    # The set costs a pass over every stored id, it only pays off when the run
+    # looks up more pages than that.
+    known = None
+    if len(subreddits) >= settings.SYNC_PRELOAD_KNOWN_SUBREDDITS:
+        known = KnownPosts.load()
+    stats = asyncio.run(
+        sync_subreddits(
+            subreddits,
+            load_cursors(subreddits),
+            known,
+            concurrency or settings.SYNC_CONCURRENCY,
+            writers or settings.SYNC_WRITERS,
+            on_subreddit_done,
+            job,
+            deadline,
+        )
+    )
+    print(
+        f"Fetched {stats['posts_fetched']} posts,",
+        f"skipped {stats['duplicates_skipped']} duplicates across listings",
+    )
+    if stats["listings_cut"] or stats["listings_skipped"]:
+        print(
+            f"Time budget spent, cut {stats['listings_cut']} listings short",
+            f"and skipped {stats['listings_skipped']}",
+        )
+    return stats
@@ -0,0 +1,150 @@
+"""
+Raw listing parser.
+Listings are fetched as plain JSON pages and turned straight into the post dicts
+the writer expects, without building PRAW `Submission` objects. That skips the
+per-post objectifying, the lazy attribute lookups and the `dir(post)` calls the
+PRAW path needs to find gallery and crosspost metadata.
+"""
+
+reddit_link = "https://www.reddit.com"
+
+
+def listing_request(
+    subreddit: str, time_frame: str, type_: str, limit: int, after: str = None
+):
+    """
+    Builds the path and params of one listing page.
+    :param subreddit: Subreddit name, or "u/<name>" for a user's submissions.
+    :param after: Fullname of the last post of the previous page.
+    :return: (path, params) for `Reddit.request`.
+    """
+    params = {"limit": limit}
+    if after:
+        params["after"] = after
+    if type_ == "top":
+        params["t"] = time_frame
+    if "u/" in subreddit:
+        params["sort"] = type_
+        return f"user/{subreddit.split('u/')[-1]}/submitted", params
+    return f"r/{subreddit}/{type_}", params
+
+
+def about_request(subreddit: str) -> str:
+    if "u/" in subreddit:
+        return f"user/{subreddit.split('u/')[-1]}/about"
+    return f"r/{subreddit}/about"
+
+
+def parse_about(subreddit: str, about: dict) -> dict:
+    """Returns the subreddit info that leads `get_subreddit_info`'s output."""
+    data = about["data"]
+    if "u/" in subreddit:
+        return {"title_sub": f"t2_{data['id']}", "display_name": data["name"]}
+    return {"title_sub": data["title"], "display_name": data["display_name"]}
+
+
+def variant(url: str, width: int, height: int) -> dict:
+    return {"url": url, "width": width, "height": height}
+
+
+def media_preview(item: dict):
+    """
+    Preview variants of one `media_metadata` item: its `p` resolutions and the
+    size of its source. None if it has neither.
+    """
+    source = item.get("s") or {}
+    variants = [
+        variant(preview["u"], preview.get("x"), preview.get("y"))
+        for preview in item.get("p") or []
+        if "u" in preview
+    ]
+    if not variants and "x" not in source:
+        return None
+    return {"width": source.get("x"), "height": source.get("y"), "variants": variants}
+
+
+def post_preview(data: dict):
+    """Preview variants of a single image post, from its `preview` resolutions."""
+    images = (data.get("preview") or {}).get("images") or []
+    if not images:
+        return None
+    source = images[0].get("source") or {}
+    return {
+        "width": source.get("width"),
+        "height": source.get("height"),
+        "variants": [
+            variant(resolution["url"], resolution.get("width"), resolution.get("height"))
+            for resolution in images[0].get("resolutions") or []
+        ],
+    }
+
+
+def parse_gallery_images(data: dict) -> list:
+    """
+    Same output as `utils.get_gallery_images`, from a raw post, plus the
+    item's "preview" when Reddit has one.
+    Raises like it does when the post has no usable metadata.
+    """
+    if "media_metadata" in data:
+        post_meta = data["media_metadata"]
+    elif "crosspost_parent" in data:
+        post_meta = data["crosspost_parent_list"][0]["media_metadata"]
+    else:
+        post_meta = {}
+    media_data = []
+    for item in post_meta.values():
+        gall_data = {}
+        if "id" in item:
+            gall_data["img_id"] = item["id"]
+        source = item.get("s")
+        if source is not None:
+            for key in ("u", "mp4", "gif"):
+                if key in source:
+                    gall_data["image"] = source[key]
+                    break
+        preview = media_preview(item)
+        if preview is not None:
+            gall_data["preview"] = preview
+        media_data.append(gall_data)
+    return media_data
+
+
+def parse_post(data: dict) -> dict:
+    """
+    Turns the `data` of a raw t3 thing into a post dict, with a "preview" of
+    the post's image sizes when Reddit has one.
+    """
+    post = {
+        "title": data["title"],
+        "content": data["selftext"],
+        "id": data["id"],
+        "score": data["score"],
+        "author": data.get("author") or "[deleted]",
+        "url": data["url"],
+        "perma_url": f"{reddit_link}/{data['permalink']}",
+        "created": data["created_utc"],
+    }
+    preview = post_preview(data)
+    if preview is not None:
+        post["preview"] = preview
+    if "gallery" in post["url"]:
+        try:
+            post["media_meta"] = parse_gallery_images(data)
+        except Exception:
+            ...
+    return post
+
+
+def parse_listing(listing: dict):
+    """
+    Parses one listing page.
+    :param listing: Decoded JSON of the page.
+    :return: (post dicts, fullname of the next page's anchor or None).
+    """
+    data = listing["data"]
+    posts = [
+        parse_post(child["data"])
+        for child in data["children"]
+        if child.get("kind") == "t3"
+    ]
+    return posts, data.get("after")
@@ -0,0 +1,84 @@
+import copy
+import json
+import time
+
+import praw
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from praw.models import Submission
+
+from gallery.listing import parse_listing
+from gallery.utils import submission_to_dict
+
+BASE_DIR = settings.BASE_DIR
+FIXTURE = BASE_DIR / "gallery" / "bench" / "listing.json"
+
+
+def build_listing(template: dict, count: int) -> dict:
+    """Repeats the fixture's posts under fresh ids until the page holds `count`."""
+    listing = copy.deepcopy(template)
+    children = template["data"]["children"]
+    listing["data"]["children"] = []
+    for index in range(count):
+        child = copy.deepcopy(children[index % len(children)])
+        child["data"]["id"] = f"{child['data']['id']}{index:x}"
+        listing["data"]["children"].append(child)
+    return listing
+
+
+def comparable(post: dict) -> dict:
+    # PRAW hands back a Redditor, the writer only ever stores its name.
+    post = {**post, "author": str(post["author"])}
+    # Preview variants are only collected by the raw parser.
+    post.pop("preview", None)
+    if "media_meta" in post:
+        post["media_meta"] = [
+            {key: value for key, value in item.items() if key != "preview"}
+            for item in post["media_meta"]
+        ]
+    return post
+
+
+class Command(BaseCommand):
+    help = 'Compare parsing raw listing JSON with building PRAW submissions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000, help='Posts per run')
+        parser.add_argument('--rounds', type=int, default=5, help='Runs of each parser, the best one counts')
+        parser.add_argument('--fixture', default=str(FIXTURE), help='Listing JSON to repeat')
+
+    def handle(self, *args, **kwargs):
+        with open(kwargs['fixture']) as f:
+            template = json.load(f)["listing"]
+        listing = build_listing(template, kwargs['posts'])
+        # Never sends a request, submissions are built from the fixture's data.
+        client = praw.Reddit(client_id="bench", client_secret="bench", user_agent="bench_parse")
+
+        def praw_path():
+            return [
+                submission_to_dict(Submission.parse(child["data"], client))
+                for child in listing["data"]["children"]
+            ]
+
+        def raw_path():
+            return parse_listing(listing)[0]
+
+        expected = [comparable(post) for post in praw_path()]
+        if [comparable(post) for post in raw_path()] != expected:
+            self.stderr.write(self.style.ERROR('Parsers disagree on the fixture.'))
+            return
+
+        per_thousand = 1000 / kwargs['posts']
+        timings = {}
+        for name, parser in (("praw", praw_path), ("raw", raw_path)):
+            best = None
+            for _ in range(kwargs['rounds']):
+                start = time.perf_counter()
+                parser()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = best * per_thousand * 1000
+            self.stdout.write(f"{name:>5}: {timings[name]:.2f} ms per 1000 posts")
+        self.stdout.write(self.style.SUCCESS(
+            f"Raw parser is {timings['praw'] / timings['raw']:.1f}x faster."
+        ))
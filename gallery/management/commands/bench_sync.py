@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+from icecream import ic
+
+from gallery.standin import FIXTURE, StandIn
+
+
+class QueryCounter:
+    """Execute wrapper counting the queries of every thread's connection."""
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def attach(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark a full sync against an offline stand-in for Reddit and the image hosts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subreddits', type=int, default=4, help='Subreddits to sync')
+        parser.add_argument('--passes', type=int, default=2, help='Syncs to run, the later ones are incremental')
+        parser.add_argument('--new-posts', type=int, default=100, help='Posts published per subreddit between passes')
+        parser.add_argument('--listing-size', type=int, default=1000, help='Posts in every listing')
+        parser.add_argument('--api-latency', type=float, default=50, help='Milliseconds per Reddit request')
+        parser.add_argument('--image-latency', type=float, default=20, help='Milliseconds per image request')
+        parser.add_argument('--api-failure-rate', type=float, default=0.0, help='Share of Reddit requests answered with a 503')
+        parser.add_argument('--image-failure-rate', type=float, default=0.05, help='Share of image requests answered with a 404')
+        parser.add_argument('--concurrency', type=int, default=None, help='Listings fetched at once')
+        parser.add_argument('--writers', type=int, default=None, help='Threads writing to the database')
+        parser.add_argument('--rpm', type=int, default=100000, help='Reddit request budget per minute')
+        parser.add_argument('--fixture', default=str(FIXTURE), help='Listing JSON the posts are built from')
+
+    def handle(self, *args, **kwargs):
+        # Every rejected image would be logged.
+        ic.disable()
+        # Never touches the configured database, the run gets a fresh test one.
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        standin = StandIn(
+            fixture=kwargs['fixture'],
+            listing_size=kwargs['listing_size'],
+            api_latency=kwargs['api_latency'] / 1000,
+            image_latency=kwargs['image_latency'] / 1000,
+            api_failure_rate=kwargs['api_failure_rate'],
+            image_failure_rate=kwargs['image_failure_rate'],
+        ).start()
+        queries = QueryCounter()
+        connection_created.connect(queries.attach)
+        try:
+            with override_settings(
+                CLIENT_ID='standin',
+                CLIENT_SECRET='standin',
+                USER_AGENT='bench_sync',
+                REDDIT_URL=standin.url,
+                REDDIT_OAUTH_URL=standin.url,
+            ):
+                self.run(standin, queries, kwargs)
+        finally:
+            connection_created.disconnect(queries.attach)
+            standin.stop()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, standin, queries, options):
+        from gallery.fetcher import run_sync
+        from gallery.models import Image, Post, SubReddit
+        from gallery.utils import set_request_budget
+
+        set_request_budget(options['rpm'])
+        queries.attach(connection=connection)
+        for index in range(options['subreddits']):
+            SubReddit.objects.create(sub_reddit=f'bench{index}', name=f'bench{index}')
+        self.stdout.write(
+            f"Stand-in at {standin.url}, {options['subreddits']} subreddits, "
+            f"{options['listing_size']} posts per listing."
+        )
+        for number in range(1, options['passes'] + 1):
+            if number > 1:
+                standin.publish(options['new_posts'])
+            standin.requests = Counter()
+            queries.count = 0
+            start = time.perf_counter()
+            stats = run_sync(
+                SubReddit.objects.all(),
+                concurrency=options['concurrency'],
+                writers=options['writers'],
+            )
+            wall = time.perf_counter() - start
+            posts = stats['posts_fetched'] - stats['duplicates_skipped']
+            per_post = max(posts, 1)
+            self.stdout.write(self.style.SUCCESS(f"Pass {number}:"))
+            self.stdout.write(f"  wall time       {wall:.2f}s")
+            self.stdout.write(f"  posts           {posts} ({posts / wall:.1f}/s)")
+            self.stdout.write(f"  reddit requests {standin.requests['listing'] + standin.requests['about']}")
+            self.stdout.write(f"  queries/post    {queries.count / per_post:.2f}")
+            self.stdout.write(f"  HEAD/post       {standin.requests['head'] / per_post:.2f}")
+            self.stdout.write(
+                f"  stored          {Post.objects.count()} posts, {Image.objects.count()} images"
+            )
@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from gallery.models import Image
+from gallery.thumbnails import get_thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Make the card thumbnails the gallery does not have yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours',
+            type=float,
+            default=None,
+            help='Only images added in the last this many hours, all of them by default',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=8,
+            help='Thumbnails made at once',
+        )
+        parser.add_argument(
+            '--evict',
+            action='store_true',
+            help='Trim the thumbnail directory to its size cap first',
+        )
+
+    def handle(self, *args, **kwargs):
+        thumbnails = get_thumbnails()
+        if kwargs['evict']:
+            deleted = thumbnails.evict()
+            self.stdout.write(f'Evicted {deleted} thumbnails.')
+        images = Image.objects.exclude(subreddit__excluded=True).only('link', 'variants')
+        if kwargs['hours'] is not None:
+            since = timezone.now() - timedelta(hours=kwargs['hours'])
+            images = images.filter(date_added__gte=since)
+        counts = thumbnails.generate(images.iterator(), kwargs['workers'])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Made {counts['made']} thumbnails, {counts['cached']} already cached, "
+                f"{counts['failed']} failed."
+            )
+        )
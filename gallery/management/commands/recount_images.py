@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from gallery.models import ImageCounter
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-subreddit image counters from the Image table'
+
+    def handle(self, *args, **kwargs):
+        counted = ImageCounter.recount()
+        self.stdout.write(self.style.SUCCESS(f'Recounted {counted} subreddits.'))
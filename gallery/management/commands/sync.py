@@ -1,14 +1,46 @@
 from django.core.management.base import BaseCommand
 from django.conf import settings
 import json
+from gallery.sharding import sync_sharded
 from gallery.utils import sync_data_with_json, sync_data
 BASE_DIR = settings.BASE_DIR
 
 class Command(BaseCommand):
     help = 'Synchronize the gallery with the database'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=1,
+            help='Split the active subreddits across this many worker processes',
+        )
+        parser.add_argument(
+            '--budget',
+            type=float,
+            default=None,
+            help='Seconds the sync may take, the subreddits expecting the most new posts go first',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Sync every active subreddit, not only the ones that are due',
+        )
+
     def handle(self, *args, **kwargs):
-        # This is a placeholder for the actual synchronization logic
-        # For example, you might want to check for new images, update existing ones, etc.
-        sync_data()
+        processes = kwargs['processes']
+        if processes > 1:
+            totals, errors = sync_sharded(processes, kwargs['budget'], kwargs['all'])
+            self.stdout.write(
+                f"Synced {totals['subreddits']} subreddits in {processes} processes, "
+                f"fetched {totals['posts_fetched']} posts, "
+                f"skipped {totals['duplicates_skipped']} duplicates."
+            )
+            for error in errors:
+                self.stderr.write(self.style.ERROR(error))
+            if errors:
+                self.stdout.write(self.style.WARNING(f'Synchronization finished with {len(errors)} errors.'))
+                return
+        else:
+            sync_data(kwargs['budget'], kwargs['all'])
         self.stdout.write(self.style.SUCCESS('Synchronization complete.'))
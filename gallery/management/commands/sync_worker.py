@@ -0,0 +1,60 @@
+import os
+import socket
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from gallery.models import Image, SyncJob
+from gallery.thumbnails import get_thumbnails
+from gallery.utils import run_sync_job
+
+
+class Command(BaseCommand):
+    help = 'Run queued sync jobs, start as many workers as needed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once the queue is empty instead of waiting for new jobs',
+        )
+        parser.add_argument(
+            '--poll',
+            type=float,
+            default=5.0,
+            help='Seconds to wait between checks of an empty queue',
+        )
+
+    def handle(self, *args, **kwargs):
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        self.stdout.write(self.style.SUCCESS(f'Sync worker {worker} started.'))
+        while True:
+            job = SyncJob.claim(worker)
+            if job is None:
+                if kwargs['once']:
+                    break
+                time.sleep(kwargs['poll'])
+                continue
+            self.stdout.write(f'Running sync job {job.pk} ({job.target}).')
+            run_sync_job(job)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Sync job {job.pk} {job.state}: '
+                    f'{job.done_subreddits}/{job.total_subreddits} subreddits.'
+                )
+            )
+            if settings.THUMBNAILS_AFTER_SYNC and job.started_on:
+                self.make_thumbnails(job)
+        self.stdout.write(self.style.SUCCESS('Queue empty.'))
+
+    def make_thumbnails(self, job):
+        """Makes the thumbnails of the images the job added, before anyone asks."""
+        images = Image.objects.filter(date_added__gte=job.started_on).only(
+            'link', 'variants'
+        )
+        counts = get_thumbnails().generate(images.iterator())
+        self.stdout.write(
+            f"Made {counts['made']} thumbnails for sync job {job.pk}, "
+            f"{counts['failed']} failed."
+        )
@@ -0,0 +1,67 @@
+"""
+In-memory membership set for post ids, loaded once per sync of many subreddits.
+Almost every post a steady-state sync sees is already stored or ignored, so the
+writer asks this set first and only goes to the database for unknown ids.
+"""
+
+import re
+
+from .models import IgnoredPosts, Post
+
+LOAD_CHUNK = 10000
+# Lowercase base36 without leading zeros, the only ids that map to one int.
+# `int(x, 36)` also takes upper case, "_", signs and whitespace.
+BASE36 = re.compile(r"[1-9a-z][0-9a-z]*")
+
+
+class KnownPosts:
+    """
+    Ids of every stored or ignored post.
+    Reddit ids are base36, so they are kept as ints, which take a fraction of
+    the memory of the strings; anything else goes to a plain string set.
+    Membership is exact, a hit never needs a database check. Ids written during
+    the run are added by the writer, set operations are atomic under the GIL so
+    writer threads can share one instance.
+    """
+
+    def __init__(self):
+        self.ids = set()
+        self.other = set()
+
+    @staticmethod
+    def encode(reddit_id: str):
+        if not BASE36.fullmatch(reddit_id):
+            return None
+        return int(reddit_id, 36)
+
+    def add(self, reddit_id: str):
+        encoded = self.encode(reddit_id)
+        if encoded is None:
+            self.other.add(reddit_id)
+        else:
+            self.ids.add(encoded)
+
+    def update(self, reddit_ids):
+        for reddit_id in reddit_ids:
+            self.add(reddit_id)
+
+    def __contains__(self, reddit_id: str) -> bool:
+        encoded = self.encode(reddit_id)
+        if encoded is None:
+            return reddit_id in self.other
+        return encoded in self.ids
+
+    def __len__(self):
+        return len(self.ids) + len(self.other)
+
+    @classmethod
+    def load(cls) -> "KnownPosts":
+        """Streams every stored and ignored post id into a new set."""
+        known = cls()
+        for model in (Post, IgnoredPosts):
+            known.update(
+                model.objects.values_list("reddit_id", flat=True).iterator(
+                    chunk_size=LOAD_CHUNK
+                )
+            )
+        return known
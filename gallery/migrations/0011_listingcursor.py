@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-18 11:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0010_post_author_post_author_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('listing', models.CharField(max_length=16)),
+                ('time_frame', models.CharField(max_length=16)),
+                ('newest_reddit_id', models.CharField(blank=True, max_length=255)),
+                ('newest_created', models.FloatField(blank=True, null=True)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+                ('subreddit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cursors', to='gallery.subreddit')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('subreddit', 'listing', 'time_frame'), name='unique_listing_cursor')],
+            },
+        ),
+    ]
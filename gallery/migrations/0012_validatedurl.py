@@ -0,0 +1,26 @@
+# Generated by Django 5.1.7 on 2026-10-18 11:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0011_listingcursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ValidatedUrl',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_hash', models.CharField(max_length=64, unique=True)),
+                ('url', models.TextField()),
+                ('status_code', models.IntegerField(blank=True, null=True)),
+                ('content_type', models.CharField(blank=True, max_length=255)),
+                ('redirect_to', models.TextField(blank=True)),
+                ('is_good', models.BooleanField(default=False)),
+                ('checked_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Removes duplicate rows ahead of the natural-key unique constraints of 0014.
+# Posts, galleries and ignored posts without a reddit_id aren't duplicates of
+# each other, they're left alone and their constraints skip blank ids.
+# Runs outside a single transaction, one batch of duplicate keys at a time, so
+# it can be applied to large databases without holding locks for the whole run.
+
+from django.db import migrations, transaction
+from django.db.models import Count, Min
+
+BATCH = 500
+
+
+def duplicate_groups(model, fields, keep_blank):
+    rows = model.objects.all()
+    if not keep_blank:
+        rows = rows.exclude(reddit_id="")
+    return (
+        rows.values(*fields)
+        .annotate(rows=Count("id"), keep=Min("id"))
+        .filter(rows__gt=1)
+        .order_by()
+    )
+
+
+def dedupe(model, fields, merge, keep_blank=False):
+    """
+    Keeps the oldest row of every duplicate group, `merge` repoints references.
+    Rows with a blank reddit_id only group with each other if `keep_blank`.
+    """
+    while True:
+        batch = list(duplicate_groups(model, fields, keep_blank)[:BATCH])
+        if not batch:
+            return
+        with transaction.atomic():
+            for group in batch:
+                keep = group["keep"]
+                extra = model.objects.filter(
+                    **{field: group[field] for field in fields}
+                ).exclude(id=keep)
+                extra_ids = list(extra.values_list("id", flat=True))
+                merge(extra_ids, keep)
+                model.objects.filter(id__in=extra_ids).delete()
+
+
+def dedupe_natural_keys(apps, schema_editor):
+    Post = apps.get_model("gallery", "Post")
+    Gallery = apps.get_model("gallery", "Gallery")
+    Image = apps.get_model("gallery", "Image")
+    IgnoredPosts = apps.get_model("gallery", "IgnoredPosts")
+    Deleted = apps.get_model("gallery", "Deleted")
+    SavedImages = apps.get_model("gallery", "SavedImages")
+
+    def merge_posts(extra_ids, keep):
+        Image.objects.filter(post_ref_id__in=extra_ids).update(post_ref_id=keep)
+        Gallery.objects.filter(post_ref_id__in=extra_ids).update(post_ref_id=keep)
+
+    def merge_galleries(extra_ids, keep):
+        Image.objects.filter(gallery_id__in=extra_ids).update(gallery_id=keep)
+        Deleted.objects.filter(gallery_id__in=extra_ids).update(gallery_id=keep)
+
+    def merge_images(extra_ids, keep):
+        SavedImages.objects.filter(image_id__in=extra_ids).update(image_id=keep)
+        Deleted.objects.filter(image_id__in=extra_ids).update(image_id=keep)
+
+    def merge_nothing(extra_ids, keep):
+        pass
+
+    # Posts first, merging them can turn their images into duplicates.
+    dedupe(Post, ["reddit_id"], merge_posts)
+    dedupe(Gallery, ["reddit_id"], merge_galleries)
+    # An image's key includes its link and subreddit, blank ids are still keyed.
+    dedupe(Image, ["reddit_id", "link", "subreddit_id"], merge_images, keep_blank=True)
+    dedupe(IgnoredPosts, ["reddit_id"], merge_nothing)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("gallery", "0012_validatedurl"),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_natural_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.7 on 2026-10-18 11:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0013_dedupe_natural_keys'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='image',
+            name='date_added',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='subreddit',
+            name='excluded',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.AddConstraint(
+            model_name='gallery',
+            constraint=models.UniqueConstraint(condition=models.Q(('reddit_id', ''), _negated=True), fields=('reddit_id',), name='unique_gallery_reddit_id'),
+        ),
+        migrations.AddConstraint(
+            model_name='ignoredposts',
+            constraint=models.UniqueConstraint(condition=models.Q(('reddit_id', ''), _negated=True), fields=('reddit_id',), name='unique_ignored_reddit_id'),
+        ),
+        migrations.AddConstraint(
+            model_name='image',
+            constraint=models.UniqueConstraint(fields=('reddit_id', 'link', 'subreddit'), name='unique_image_per_subreddit'),
+        ),
+        migrations.AddConstraint(
+            model_name='post',
+            constraint=models.UniqueConstraint(condition=models.Q(('reddit_id', ''), _negated=True), fields=('reddit_id',), name='unique_post_reddit_id'),
+        ),
+    ]
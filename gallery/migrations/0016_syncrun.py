@@ -0,0 +1,40 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0015_syncjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('listing', models.CharField(max_length=16)),
+                ('time_frame', models.CharField(max_length=16)),
+                ('started_on', models.DateTimeField(db_index=True)),
+                ('duration', models.FloatField(default=0)),
+                ('fetch_seconds', models.FloatField(default=0)),
+                ('prepare_seconds', models.FloatField(default=0)),
+                ('commit_seconds', models.FloatField(default=0)),
+                ('api_calls', models.IntegerField(default=0)),
+                ('pages_fetched', models.IntegerField(default=0)),
+                ('posts_seen', models.IntegerField(default=0)),
+                ('posts_new', models.IntegerField(default=0)),
+                ('posts_ignored', models.IntegerField(default=0)),
+                ('head_requests', models.IntegerField(default=0)),
+                ('cache_hits', models.IntegerField(default=0)),
+                ('db_queries', models.IntegerField(default=0)),
+                ('rows_inserted', models.IntegerField(default=0)),
+                ('errors', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='runs', to='gallery.syncjob')),
+                ('subreddit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_runs', to='gallery.subreddit')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0016_syncrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subreddit',
+            name='last_new_posts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='subreddit',
+            name='post_rate',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
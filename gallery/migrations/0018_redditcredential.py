@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0017_subreddit_post_rate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RedditCredential',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, max_length=255)),
+                ('client_id', models.CharField(max_length=255, unique=True)),
+                ('client_secret', models.CharField(blank=True, max_length=255)),
+                ('user_agent', models.CharField(blank=True, max_length=255)),
+                ('is_active', models.BooleanField(default=True)),
+                ('added_on', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0019_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['-date_added', '-id'], name='image_date_id'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['subreddit', '-date_added', '-id'], name='image_sub_date_id'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def count_images(apps, schema_editor):
+    """Fills the counters of the existing subreddits, one GROUP BY over Image."""
+    SubReddit = apps.get_model("gallery", "SubReddit")
+    Image = apps.get_model("gallery", "Image")
+    ImageCounter = apps.get_model("gallery", "ImageCounter")
+    found = {
+        row["subreddit"]: row
+        for row in Image.objects.filter(subreddit__isnull=False)
+        .values("subreddit")
+        .annotate(images=Count("id"), newest_id=Max("id"), newest_added=Max("date_added"))
+        .order_by()
+    }
+    ImageCounter.objects.bulk_create(
+        [
+            ImageCounter(
+                subreddit_id=pk,
+                images=found.get(pk, {}).get("images", 0),
+                newest_image_id=found.get(pk, {}).get("newest_id"),
+                newest_added=found.get(pk, {}).get("newest_added"),
+            )
+            for pk in SubReddit.objects.values_list("pk", flat=True)
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0020_image_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('images', models.IntegerField(default=0)),
+                ('newest_added', models.DateTimeField(blank=True, null=True)),
+                ('newest_image', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='gallery.image')),
+                ('subreddit', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='image_counter', to='gallery.subreddit')),
+            ],
+        ),
+        migrations.RunPython(count_images, migrations.RunPython.noop),
+    ]
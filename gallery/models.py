@@ -1,6 +1,9 @@
-from django.db import models
+from datetime import timedelta
+from django.db import models, transaction
+from django.utils import timezone
 import os
 from django.conf import settings
+from .caching import IMAGES, bump_versions, subreddit_scope
 
 # Create your models here.
 
@@ -17,11 +20,75 @@ class SubReddit(models.Model):
     added_on = models.DateTimeField(auto_now_add=True)
     updated_on = models.DateTimeField(blank=True, null=True)
     is_active = models.BooleanField(default=True)
-    excluded = models.BooleanField(default=False)
+    excluded = models.BooleanField(default=False, db_index=True)
+    # New posts per hour, smoothed over syncs, unknown until the second sync,
+    # and what the last sync found.
+    post_rate = models.FloatField(blank=True, null=True)
+    last_new_posts = models.IntegerField(default=0)
+
+    # Weight of the latest sync in `post_rate`.
+    RATE_SMOOTHING = 0.5
 
     def __str__(self):
         return f"{self.sub_reddit} - Active: {self.is_active} - Excluded: {self.excluded}"
 
+    def hours_since_sync(self, now=None):
+        if self.updated_on is None:
+            return None
+        now = now or timezone.now()
+        return max((now - self.updated_on).total_seconds() / 3600, 0)
+
+    def expected_posts(self, now=None) -> float:
+        """New posts a sync would find now, infinite while the rate is unknown."""
+        hours = self.hours_since_sync(now)
+        if hours is None or self.post_rate is None:
+            return float("inf")
+        return self.post_rate * hours
+
+    def record_sync(self, new_posts: int, now=None):
+        """Stores a complete sync's result, `updated_on` is the last sync."""
+        now = now or timezone.now()
+        hours = self.hours_since_sync(now)
+        if hours:
+            rate = new_posts / max(hours, 1 / 60)
+            if self.post_rate is not None:
+                rate = (
+                    self.RATE_SMOOTHING * rate
+                    + (1 - self.RATE_SMOOTHING) * self.post_rate
+                )
+            self.post_rate = rate
+        self.last_new_posts = new_posts
+        self.updated_on = now
+        self.save(update_fields=["post_rate", "last_new_posts", "updated_on"])
+
+
+class ListingCursor(models.Model):
+    """
+    High-water mark of one (subreddit, listing, time frame).
+    Holds the newest post seen on the last successful sync, later syncs stop
+    paging once they reach posts older than it.
+    """
+
+    subreddit = models.ForeignKey(
+        SubReddit, on_delete=models.CASCADE, related_name="cursors"
+    )
+    listing = models.CharField(max_length=16)
+    time_frame = models.CharField(max_length=16)
+    newest_reddit_id = models.CharField(max_length=255, blank=True)
+    newest_created = models.FloatField(blank=True, null=True)
+    updated_on = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["subreddit", "listing", "time_frame"],
+                name="unique_listing_cursor",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.subreddit.sub_reddit} - {self.listing}/{self.time_frame} - {self.newest_reddit_id}"
+
 
 class Post(models.Model):
     subreddit = models.ForeignKey(
@@ -36,20 +103,45 @@ class Post(models.Model):
     score = models.IntegerField(default=0)
     date_added = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["reddit_id"],
+                condition=~models.Q(reddit_id=""),
+                name="unique_post_reddit_id",
+            )
+        ]
+
     def __str__(self):
         return f"{self.subreddit.name} - {self.link} - {self.title}"
 
+    @staticmethod
+    def build_author_url(author) -> str:
+        return f"""https://www.reddit.com/user/{author}""" if author else ""
+
     def save(self, *args, **kwargs):
         if self.author:
-            self.author_url = f"""https://www.reddit.com/user/{self.author}"""
+            self.author_url = self.build_author_url(self.author)
         super().save(*args, **kwargs)
 
+    @staticmethod
+    def annotate_deleted(queryset):
+        """Adds `is_deleted` to every post of a queryset, in the same query."""
+        return queryset.annotate(
+            is_deleted=models.Exists(
+                Deleted.objects.filter(reddit_id=models.OuterRef("reddit_id"))
+            )
+        )
+
     @property
     def check_deleted(self):
         """
         Check if the post is deleted by looking for a Deleted entry with the same reddit_id.
+        Posts from `annotate_deleted` already know.
         """
-        return Deleted.objects.filter(post=self).exists()
+        if hasattr(self, "is_deleted"):
+            return self.is_deleted
+        return Deleted.objects.filter(reddit_id=self.reddit_id).exists()
 
 
 class Gallery(models.Model):
@@ -60,6 +152,15 @@ class Gallery(models.Model):
     reddit_id = models.CharField(max_length=255, blank=True)
     link = models.URLField(blank=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["reddit_id"],
+                condition=~models.Q(reddit_id=""),
+                name="unique_gallery_reddit_id",
+            )
+        ]
+
     def __str__(self):
         return f"{self.subreddit} - {self.link}"
 
@@ -73,16 +174,64 @@ class Image(models.Model):
     )
     reddit_id = models.CharField(max_length=255, blank=True)
     link = models.URLField(blank=True)
-    date_added = models.DateTimeField(auto_now_add=True)
+    date_added = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Size of the original and the downscaled copies Reddit serves of it,
+    # [{"url", "width", "height"}] smallest first.
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    variants = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["reddit_id", "link", "subreddit"],
+                name="unique_image_per_subreddit",
+            )
+        ]
+        # Gallery pages seek on (date_added, id), see `pagination.keyset_page`.
+        indexes = [
+            models.Index(fields=["-date_added", "-id"], name="image_date_id"),
+            models.Index(
+                fields=["subreddit", "-date_added", "-id"], name="image_sub_date_id"
+            ),
+        ]
 
     def __str__(self):
         return super().__str__() + f" - {self.link} - {self.post_ref} - {self.subreddit}"
 
+    def variant_url(self, width: int) -> str:
+        """
+        URL of the smallest variant at least `width` wide, the largest one if
+        none is, the original if there are no variants.
+        """
+        variants = [variant for variant in self.variants if variant.get("width")]
+        if not variants:
+            return self.link
+        fitting = [variant for variant in variants if variant["width"] >= width]
+        if fitting:
+            return min(fitting, key=lambda variant: variant["width"])["url"]
+        return max(variants, key=lambda variant: variant["width"])["url"]
+
+    @property
+    def thumbnail_url(self) -> str:
+        """URL to show on a gallery card, see `CARD_IMAGE_WIDTH`."""
+        return self.variant_url(settings.CARD_IMAGE_WIDTH)
+
+    @staticmethod
+    def annotate_deleted(queryset):
+        """Adds `is_deleted` to every image of a queryset, in the same query."""
+        return queryset.annotate(
+            is_deleted=models.Exists(Deleted.objects.filter(image=models.OuterRef("pk")))
+        )
+
     @property
     def check_deleted(self):
         """
         Check if the image is deleted by looking for a Deleted entry with the same reddit_id.
+        Images from `annotate_deleted` already know.
         """
+        if hasattr(self, "is_deleted"):
+            return self.is_deleted
         return Deleted.objects.filter(image=self).exists()
 
 
@@ -102,6 +251,133 @@ class Deleted(models.Model):
     def __str__(self):
         return f"{self.reddit_id} - {self.title}"
 
+class ImageCounter(models.Model):
+    """
+    Image total and newest image of one subreddit, so pages don't COUNT the
+    Image table. The sync writer adds to it and every image delete
+    recounts, see `signals.image_deleted`. Totals of a category or of every subreddit add up these rows,
+    which keeps the writers off a single hot global row.
+    Images left without a subreddit aren't counted.
+    """
+
+    subreddit = models.OneToOneField(
+        SubReddit, on_delete=models.CASCADE, related_name="image_counter"
+    )
+    images = models.IntegerField(default=0)
+    newest_image = models.ForeignKey(
+        Image, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    newest_added = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.subreddit_id} - {self.images} images"
+
+    @classmethod
+    def add(cls, subreddit: SubReddit, images: int, newest_id: int, newest_added):
+        """Counts images a sync just inserted for a subreddit."""
+        if not images:
+            return
+        # Overlapping syncs of one subreddit can commit out of order, the
+        # newest image only ever moves forward.
+        newer = models.Q(newest_added__isnull=True) | models.Q(
+            newest_added__lte=newest_added
+        )
+        updated = cls.objects.filter(subreddit=subreddit).update(
+            images=models.F("images") + images,
+            newest_image_id=models.Case(
+                models.When(newer, then=models.Value(newest_id)),
+                default=models.F("newest_image_id"),
+                output_field=models.BigIntegerField(),
+            ),
+            newest_added=models.Case(
+                models.When(newer, then=models.Value(newest_added)),
+                default=models.F("newest_added"),
+            ),
+        )
+        if not updated:
+            cls.recount([subreddit.pk])
+            return
+        # Once committed, or a page could be cached from before the write.
+        transaction.on_commit(
+            lambda: bump_versions([IMAGES, subreddit_scope(subreddit.pk)])
+        )
+
+    @classmethod
+    def recount(cls, subreddits=None) -> int:
+        """
+        Rebuilds the counters from the Image table.
+        :param subreddits: Ids or SubReddits to recount, all of them if None.
+        :return: Number of counters written.
+        """
+        scope = SubReddit.objects.all()
+        if subreddits is not None:
+            scope = scope.filter(pk__in=[getattr(sub, "pk", sub) for sub in subreddits])
+        subreddit_ids = list(scope.values_list("pk", flat=True))
+        found = {
+            row["subreddit"]: row
+            for row in Image.objects.filter(subreddit__in=subreddit_ids)
+            .values("subreddit")
+            .annotate(
+                images=models.Count("id"),
+                newest_id=models.Max("id"),
+                newest_added=models.Max("date_added"),
+            )
+        }
+        counters = [
+            cls(
+                subreddit_id=pk,
+                images=found.get(pk, {}).get("images", 0),
+                newest_image_id=found.get(pk, {}).get("newest_id"),
+                newest_added=found.get(pk, {}).get("newest_added"),
+            )
+            for pk in subreddit_ids
+        ]
+        cls.objects.bulk_create(
+            counters,
+            update_conflicts=True,
+            unique_fields=["subreddit"],
+            update_fields=["images", "newest_image", "newest_added"],
+        )
+        transaction.on_commit(
+            lambda: bump_versions(
+                [IMAGES] + [subreddit_scope(pk) for pk in subreddit_ids]
+            )
+        )
+        return len(counters)
+
+    @classmethod
+    def scope(cls, subreddits=None):
+        counters = cls.objects.all()
+        if subreddits is not None:
+            counters = counters.filter(subreddit__in=subreddits)
+        return counters
+
+    @classmethod
+    def total(cls, subreddits=None) -> int:
+        """Image total of some subreddits, of all of them if None."""
+        return cls.scope(subreddits).aggregate(images=models.Sum("images", default=0))[
+            "images"
+        ]
+
+    @classmethod
+    def totals(cls, subreddits=None) -> dict:
+        """
+        Image total and newest image of some subreddits, of all of them if None.
+        :return: {"images": int, "newest_image": Image or None}
+        """
+        newest = (
+            cls.scope(subreddits)
+            .filter(newest_image__isnull=False)
+            .select_related("newest_image")
+            .order_by("-newest_added")
+            .first()
+        )
+        return {
+            "images": cls.total(subreddits),
+            "newest_image": newest.newest_image if newest else None,
+        }
+
+
 class Category(models.Model):
     name = models.CharField(max_length=255, blank=True, default="Undefined")
     description = models.TextField(blank=True)
@@ -155,6 +431,156 @@ class Category(models.Model):
             return True
         return False
 
+class SyncJob(models.Model):
+    """
+    A sync requested from the UI, picked up by `manage.py sync_worker`.
+    A job without subreddit and category syncs every active subreddit.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    subreddit = models.ForeignKey(
+        SubReddit, on_delete=models.CASCADE, null=True, blank=True
+    )
+    category = models.ForeignKey(
+        Category, on_delete=models.CASCADE, null=True, blank=True
+    )
+    state = models.CharField(
+        max_length=16, choices=STATES, default=QUEUED, db_index=True
+    )
+    total_subreddits = models.IntegerField(default=0)
+    done_subreddits = models.IntegerField(default=0)
+    posts_fetched = models.IntegerField(default=0)
+    worker = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+    started_on = models.DateTimeField(blank=True, null=True)
+    finished_on = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.target} - {self.state} - {self.done_subreddits}/{self.total_subreddits}"
+
+    @property
+    def target(self):
+        if self.subreddit:
+            return self.subreddit.sub_reddit
+        if self.category:
+            return self.category.name
+        return "All"
+
+    def get_subreddits(self):
+        if self.subreddit:
+            return SubReddit.objects.filter(pk=self.subreddit_id)
+        if self.category:
+            return self.category.subreddits.all().order_by("-id")
+        return SubReddit.objects.filter(is_active=True).order_by("-id")
+
+    @classmethod
+    def enqueue(cls, subreddit=None, category=None):
+        return cls.objects.create(subreddit=subreddit, category=category)
+
+    @classmethod
+    def claim(cls, worker: str):
+        """
+        Marks the oldest queued job as running and returns it, None if the
+        queue is empty. Rows locked by other workers are skipped, so any number
+        of workers can drain the queue at once.
+        """
+        with transaction.atomic():
+            job = (
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(state=cls.QUEUED)
+                .order_by("id")
+                .first()
+            )
+            if job is None:
+                return None
+            job.state = cls.RUNNING
+            job.worker = worker
+            job.started_on = timezone.now()
+            job.save(update_fields=["state", "worker", "started_on"])
+        return job
+
+
+class SyncRun(models.Model):
+    """
+    Telemetry of one listing of one subreddit in one sync, see `telemetry.py`.
+    Stage timings are thread-seconds, pages of a listing overlap in the pipeline.
+    """
+
+    subreddit = models.ForeignKey(
+        SubReddit, on_delete=models.CASCADE, related_name="sync_runs"
+    )
+    job = models.ForeignKey(
+        SyncJob, on_delete=models.SET_NULL, null=True, blank=True, related_name="runs"
+    )
+    listing = models.CharField(max_length=16)
+    time_frame = models.CharField(max_length=16)
+    started_on = models.DateTimeField(db_index=True)
+    duration = models.FloatField(default=0)
+    fetch_seconds = models.FloatField(default=0)
+    prepare_seconds = models.FloatField(default=0)
+    commit_seconds = models.FloatField(default=0)
+    api_calls = models.IntegerField(default=0)
+    pages_fetched = models.IntegerField(default=0)
+    posts_seen = models.IntegerField(default=0)
+    posts_new = models.IntegerField(default=0)
+    posts_ignored = models.IntegerField(default=0)
+    head_requests = models.IntegerField(default=0)
+    cache_hits = models.IntegerField(default=0)
+    db_queries = models.IntegerField(default=0)
+    rows_inserted = models.IntegerField(default=0)
+    errors = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    SUMMED = [
+        "duration",
+        "fetch_seconds",
+        "prepare_seconds",
+        "commit_seconds",
+        "api_calls",
+        "pages_fetched",
+        "posts_seen",
+        "posts_new",
+        "posts_ignored",
+        "head_requests",
+        "cache_hits",
+        "db_queries",
+        "rows_inserted",
+        "errors",
+    ]
+
+    def __str__(self):
+        return f"{self.subreddit.sub_reddit} {self.listing}/{self.time_frame} - {self.duration:.1f}s"
+
+    @classmethod
+    def summary(cls, hours: int = 24, top: int = 10):
+        """
+        Totals of the runs of the last `hours`, overall and for the `top`
+        subreddits that took the longest.
+        """
+        runs = cls.objects.filter(
+            started_on__gte=timezone.now() - timedelta(hours=hours)
+        )
+        sums = {field: models.Sum(field, default=0) for field in cls.SUMMED}
+        totals = runs.aggregate(runs=models.Count("id"), **sums)
+        subreddits = (
+            runs.values("subreddit__sub_reddit")
+            .annotate(runs=models.Count("id"), **sums)
+            .order_by("-duration")[:top]
+        )
+        return totals, list(subreddits)
+
+
 class Settings(models.Model):
     client_id = models.CharField(max_length=255, blank=True)
     client_secret = models.CharField(max_length=255, blank=True)
@@ -168,9 +594,54 @@ class Settings(models.Model):
             return None
 
 
+class RedditCredential(models.Model):
+    """
+    An extra Reddit app for the sync, on top of the one in the settings.
+    Every app has its own rate limit, see `clients.ClientPool`.
+    """
+
+    name = models.CharField(max_length=255, blank=True)
+    client_id = models.CharField(max_length=255, unique=True)
+    client_secret = models.CharField(max_length=255, blank=True)
+    user_agent = models.CharField(max_length=255, blank=True)
+    is_active = models.BooleanField(default=True)
+    added_on = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name or self.client_id} - Active: {self.is_active}"
+
+
 class IgnoredPosts(models.Model):
     reddit_id = models.CharField(blank=True, max_length=255)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["reddit_id"],
+                condition=~models.Q(reddit_id=""),
+                name="unique_ignored_reddit_id",
+            )
+        ]
+
+
+class ValidatedUrl(models.Model):
+    """
+    Outcome of the last HEAD check of an image URL.
+    Keyed on a hash of the normalized URL, entries older than
+    `VALIDATION_CACHE_TTL` are checked again.
+    """
+
+    url_hash = models.CharField(max_length=64, unique=True)
+    url = models.TextField()
+    status_code = models.IntegerField(blank=True, null=True)
+    content_type = models.CharField(max_length=255, blank=True)
+    redirect_to = models.TextField(blank=True)
+    is_good = models.BooleanField(default=False)
+    checked_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.url} - {self.status_code} - Good: {self.is_good}"
+
 
 class SavedImages(models.Model):
     image = models.ForeignKey(Image, on_delete=models.CASCADE, null=True, blank=True)
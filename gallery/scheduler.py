@@ -0,0 +1,42 @@
+"""
+Sync scheduling.
+Every complete sync of a subreddit records how many new posts it produced, see
+`SubReddit.record_sync`, which gives it a smoothed post rate. A run syncs the
+subreddits that should have the most new posts by now first, and leaves out
+the quiet ones until enough is expected to have piled up or they haven't been
+synced for `SYNC_MAX_INTERVAL_HOURS`.
+"""
+
+from django.conf import settings
+from django.utils import timezone
+
+
+def is_due(subreddit, now) -> bool:
+    hours = subreddit.hours_since_sync(now)
+    if hours is None:
+        return True
+    if hours >= settings.SYNC_MAX_INTERVAL_HOURS:
+        return True
+    return subreddit.expected_posts(now) >= settings.SYNC_MIN_EXPECTED_POSTS
+
+
+def plan_sync(subreddits, everything: bool = False, now=None) -> list:
+    """
+    Orders subreddits by the new posts they are expected to have, highest first.
+    Never synced subreddits come first, then the ones synced longest ago.
+    :param subreddits: SubReddit objects or a queryset of them.
+    :param everything: Keep the subreddits that aren't due yet, at the end.
+    :return: List of SubReddit objects to sync, in order.
+    """
+    now = now or timezone.now()
+    ranked = sorted(
+        subreddits,
+        key=lambda subreddit: (
+            subreddit.expected_posts(now),
+            subreddit.hours_since_sync(now) or 0,
+        ),
+        reverse=True,
+    )
+    if everything:
+        return ranked
+    return [subreddit for subreddit in ranked if is_due(subreddit, now)]
@@ -43,16 +43,16 @@ class ImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Image
         fields = [
-            'id', 'reddit_id', 'link', 'date_added', 'subreddit',
-            'gallery', 'check_deleted'
+            'id', 'reddit_id', 'link', 'thumbnail_url', 'width', 'height',
+            'date_added', 'subreddit', 'gallery', 'check_deleted'
         ]
 
 class MultiImageView(serializers.ModelSerializer):
     class Meta:
         model = Image
         fields = [
-            'id', 'reddit_id', 'link', 'date_added', 'subreddit', 'post_ref',
-            'gallery', 'check_deleted'
+            'id', 'reddit_id', 'link', 'thumbnail_url', 'width', 'height',
+            'date_added', 'subreddit', 'post_ref', 'gallery', 'check_deleted'
         ]
 
 
@@ -0,0 +1,99 @@
+"""
+Multi-process sync.
+Active subreddits are split across worker processes by a stable hash of their
+name, every process runs the usual concurrent sync over its shard with its own
+Reddit clients, DB connections and its share of the request budget.
+Workers are spawned fresh, so models are only imported once Django is set up.
+"""
+
+import multiprocessing
+import traceback
+import zlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def shard_of(sub_reddit: str, shards: int) -> int:
+    """Same subreddit, same shard, on every run and every machine."""
+    return zlib.crc32(sub_reddit.strip().lower().encode()) % shards
+
+
+def init_worker(requests_per_minute: int):
+    import django
+
+    django.setup()
+    from .utils import set_request_budget
+
+    set_request_budget(requests_per_minute)
+
+
+def sync_shard(
+    shard: int, shards: int, budget: float = None, everything: bool = False
+) -> tuple:
+    """
+    Syncs the due subreddits of one shard, runs in a worker process.
+    :return: (shard, subreddit count, stats, errors)
+    """
+    from django.db import connections
+
+    from .fetcher import run_sync
+    from .models import SubReddit
+    from .scheduler import plan_sync
+
+    stats = Counter()
+    errors = []
+    subreddits = plan_sync(
+        [
+            subreddit
+            for subreddit in SubReddit.objects.filter(is_active=True)
+            if shard_of(subreddit.sub_reddit, shards) == shard
+        ],
+        everything,
+    )
+    try:
+        stats = run_sync(subreddits, budget=budget)
+    except Exception:
+        errors.append(traceback.format_exc())
+    finally:
+        connections.close_all()
+    return shard, len(subreddits), dict(stats), errors
+
+
+def sync_sharded(
+    processes: int, budget: float = None, everything: bool = False
+) -> tuple:
+    """
+    Syncs the due subreddits across `processes` worker processes.
+    :param budget: Seconds every shard may take.
+    :param everything: Sync every active subreddit, due or not.
+    :return: (summed stats of all shards, list of errors)
+    """
+    from django.conf import settings
+    from django.db import connections
+
+    # Workers must not inherit open connections.
+    connections.close_all()
+    per_minute = max(1, settings.REDDIT_REQUESTS_PER_MINUTE // processes)
+    totals = Counter()
+    errors = []
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(per_minute,),
+    ) as pool:
+        futures = {
+            pool.submit(sync_shard, shard, processes, budget, everything): shard
+            for shard in range(processes)
+        }
+        for future in as_completed(futures):
+            try:
+                shard, subreddit_count, stats, shard_errors = future.result()
+            except Exception as e:
+                errors.append(f"shard {futures[future]}: {e}")
+                continue
+            print(f"Shard {shard} synced {subreddit_count} subreddits")
+            totals["subreddits"] += subreddit_count
+            totals.update(stats)
+            errors.extend(f"shard {shard}: {error}" for error in shard_errors)
+    return totals, errors
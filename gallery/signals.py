@@ -0,0 +1,70 @@
+"""
+Invalidates cached pages when what they show changes outside a sync: the
+folder dashboard's category blocks and the galleries' sidebars on a
+subreddit's name or exclusion, categories, or who belongs to them, and the
+image API's deleted flags on `Deleted` rows. Syncs bump image versions
+through `ImageCounter`, and every image delete, from the clean buttons, the
+API or the admin, recounts its subreddits. Connected in `GalleryConfig.ready`.
+"""
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import FOLDERS, IMAGES, bump_version
+from .models import Category, Deleted, Image, ImageCounter, SubReddit
+
+# Saves touching only other fields, like a sync's `record_sync`, keep the cache.
+FOLDER_FIELDS = {"sub_reddit", "excluded"}
+
+
+@receiver(post_save, sender=SubReddit)
+def subreddit_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created or update_fields is None or FOLDER_FIELDS & set(update_fields):
+        bump_version(FOLDERS)
+
+
+@receiver(post_delete, sender=SubReddit)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def folders_changed(sender, **kwargs):
+    bump_version(FOLDERS)
+
+
+@receiver(m2m_changed, sender=Category.subreddits.through)
+def categories_changed(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        bump_version(FOLDERS)
+
+
+@receiver(post_save, sender=Deleted)
+@receiver(post_delete, sender=Deleted)
+def deleted_changed(sender, **kwargs):
+    bump_version(IMAGES)
+
+
+class Recount:
+    """On-commit recount of the subreddits a transaction deleted images from."""
+
+    def __init__(self):
+        self.subreddits = set()
+
+    def __call__(self):
+        ImageCounter.recount(self.subreddits)
+
+
+@receiver(post_delete, sender=Image)
+def image_deleted(sender, instance, using, **kwargs):
+    if instance.subreddit_id is None:
+        return
+    connection = transaction.get_connection(using)
+    # A cascade deletes images one signal at a time, they share one recount
+    # per transaction (and savepoint, so a rolled back one takes its own).
+    savepoints = set(connection.savepoint_ids)
+    for sids, func, _ in connection.run_on_commit:
+        if isinstance(func, Recount) and sids == savepoints:
+            func.subreddits.add(instance.subreddit_id)
+            return
+    recount = Recount()
+    recount.subreddits.add(instance.subreddit_id)
+    transaction.on_commit(recount, using=using)
@@ -0,0 +1,254 @@
+"""
+Offline stand-in for Reddit and the image hosts, used by `manage.py bench_sync`.
+Serves the OAuth token endpoint, about pages and listing pages built from the
+posts in `gallery/bench/listing.json`, plus HEAD/GET answers for the images
+those posts link to, all from one local HTTP server. Latency and failure rates
+are configurable, and every request is counted so the benchmark can report
+network use per post.
+"""
+
+import base64
+import json
+import random
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+
+FIXTURE = settings.BASE_DIR / "gallery" / "bench" / "listing.json"
+# Images on these hosts are served by the stand-in, the rest keep their real
+# URL and are skipped by `clean_url`/`ImageValidator` like they are in a real sync.
+IMAGE_HOSTS = ["https://i.redd.it/", "https://preview.redd.it/"]
+CONTENT_TYPES = {
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "webp": "image/webp",
+    "gif": "image/gif",
+    "mp4": "video/mp4",
+}
+# Where each listing starts in a subreddit's posts, so they overlap like real ones.
+LISTING_OFFSETS = {"new": 0, "hot": 20, "day": 50, "month": 200, "all": 500}
+POST_INTERVAL = 60
+# Reddit's rate limit window, every app gets `rate_limit` requests per window.
+RATE_WINDOW = 600
+
+
+class StandIn:
+    """
+    Generates the posts of every subreddit on the fly.
+    A subreddit's posts are numbered, the newest being `head - 1`, and
+    `publish` moves the head forward to simulate new posts between syncs.
+    """
+
+    def __init__(
+        self,
+        fixture=FIXTURE,
+        listing_size: int = 1000,
+        api_latency: float = 0.0,
+        image_latency: float = 0.0,
+        api_failure_rate: float = 0.0,
+        image_failure_rate: float = 0.0,
+        rate_limit: int = 1000,
+        seed: int = 0,
+    ):
+        with open(fixture) as f:
+            data = json.load(f)
+        self.about = data["about"]
+        self.templates = [
+            (child["data"]["id"], json.dumps(child))
+            for child in data["listing"]["data"]["children"]
+        ]
+        self.listing_size = listing_size
+        self.api_latency = api_latency
+        self.image_latency = image_latency
+        self.api_failure_rate = api_failure_rate
+        self.image_failure_rate = image_failure_rate
+        self.random = random.Random(seed)
+        self.head = listing_size + max(LISTING_OFFSETS.values())
+        self.epoch = time.time() - self.head * POST_INTERVAL
+        self.rate_limit = rate_limit
+        self.window_start = time.monotonic()
+        self.used = Counter()
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StandIn":
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(self))
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def publish(self, posts: int):
+        """Adds `posts` new posts to the top of every subreddit."""
+        self.head += posts
+
+    def count(self, kind: str):
+        with self.lock:
+            self.requests[kind] += 1
+
+    def fails(self, rate: float) -> bool:
+        with self.lock:
+            return self.random.random() < rate
+
+    def rate_headers(self, app: str) -> dict:
+        """Counts a request against the app's window, like Reddit reports it."""
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= RATE_WINDOW:
+                self.window_start = now
+                self.used = Counter()
+            self.used[app] += 1
+            return {
+                "x-ratelimit-used": str(self.used[app]),
+                "x-ratelimit-remaining": str(max(self.rate_limit - self.used[app], 0)),
+                "x-ratelimit-reset": str(int(RATE_WINDOW - (now - self.window_start))),
+            }
+
+    def post(self, subreddit: str, number: int) -> dict:
+        template_id, template = self.templates[number % len(self.templates)]
+        post_id = f"{subreddit.lower()}z{number:x}"
+        text = template.replace(template_id, post_id)
+        for host in IMAGE_HOSTS:
+            text = text.replace(host, f"{self.url}/img/{post_id}/")
+        child = json.loads(text)
+        child["data"]["created_utc"] = child["data"]["created"] = (
+            self.epoch + number * POST_INTERVAL
+        )
+        return child
+
+    def listing(self, subreddit: str, sort: str, time_frame: str, params: dict) -> dict:
+        offset = LISTING_OFFSETS[time_frame if sort == "top" else sort]
+        limit = min(int(params.get("limit", 25)), 100)
+        start = int(params["after"].split("_")[-1]) if params.get("after") else 0
+        end = min(start + limit, self.listing_size)
+        newest = self.head - 1 - offset
+        children = [
+            self.post(subreddit, newest - index)
+            for index in range(start, end)
+            if newest - index >= 0
+        ]
+        return {
+            "kind": "Listing",
+            "data": {
+                "after": f"t3_{end}" if end < self.listing_size and children else None,
+                "dist": len(children),
+                "children": children,
+                "before": None,
+            },
+        }
+
+    def api(self, path: str, params: dict, app: str = ""):
+        """
+        Returns (status, body) of an API request.
+        :param app: client_id of the request, Basic auth for the token and the
+            token afterwards.
+        """
+        parts = [part for part in path.split("/") if part]
+        if parts == ["api", "v1", "access_token"]:
+            self.count("token")
+            return 200, {
+                "access_token": f"standin-{app}",
+                "token_type": "bearer",
+                "expires_in": 3600,
+                "scope": "*",
+            }
+        if len(parts) != 3 or parts[0] not in ("r", "user"):
+            return 404, {"message": "Not Found", "error": 404}
+        self.count(f"app:{app}")
+        time.sleep(self.api_latency)
+        if self.fails(self.api_failure_rate):
+            self.count("api_failed")
+            return 503, {"message": "Service Unavailable", "error": 503}
+        kind, name, action = parts
+        if action == "about":
+            self.count("about")
+            if kind == "user":
+                return 200, {"kind": "t2", "data": {"id": name.lower(), "name": name}}
+            about = json.loads(json.dumps(self.about))
+            about["data"]["display_name"] = name
+            return 200, about
+        self.count("listing")
+        sort = params.get("sort", "new") if kind == "user" else action
+        if sort not in ("new", "hot", "top"):
+            return 404, {"message": "Not Found", "error": 404}
+        return 200, self.listing(name, sort, params.get("t", "day"), params)
+
+    def image(self, path: str):
+        """Returns (status, content type) of an image request."""
+        time.sleep(self.image_latency)
+        if self.fails(self.image_failure_rate):
+            return 404, "text/html"
+        extension = path.rsplit(".", 1)[-1].lower()
+        return 200, CONTENT_TYPES.get(extension, "text/html")
+
+
+def make_handler(standin: StandIn):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def answer(
+            self, status: int, content_type: str, body: bytes = b"", headers=None
+        ):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+
+        def handle_api(self):
+            url = urllib.parse.urlsplit(self.path)
+            params = dict(urllib.parse.parse_qsl(url.query))
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                params.update(urllib.parse.parse_qsl(self.rfile.read(length).decode()))
+            scheme, _, credentials = self.headers.get("Authorization", "").partition(" ")
+            if scheme.lower() == "basic":
+                app = base64.b64decode(credentials).decode().split(":")[0]
+                headers = None
+            else:
+                app = credentials.removeprefix("standin-")
+                headers = standin.rate_headers(app)
+            status, body = standin.api(url.path, params, app)
+            self.answer(status, "application/json", json.dumps(body).encode(), headers)
+
+        def handle_image(self):
+            standin.count(self.command.lower())
+            status, content_type = standin.image(urllib.parse.urlsplit(self.path).path)
+            self.answer(status, content_type, b"\0" * 64 if status == 200 else b"")
+
+        def do_GET(self):
+            if self.path.startswith("/img/"):
+                self.handle_image()
+            else:
+                self.handle_api()
+
+        def do_POST(self):
+            self.handle_api()
+
+        def do_HEAD(self):
+            if self.path.startswith("/img/"):
+                self.handle_image()
+            else:
+                self.answer(405, "text/plain")
+
+    return Handler
@@ -0,0 +1,103 @@
+"""
+Sync telemetry.
+Every listing of a sync gets a `ListingStats` that follows its pages through
+the fetch, prepare and commit threads. Work is attributed to it through a
+context variable set around each stage, so the Reddit requestor, the image
+validator, the writer and the database cursor can count what they do without
+being handed the stats. The totals end up in a `SyncRun` row.
+"""
+
+import contextvars
+import threading
+import time
+from collections import Counter
+
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import SyncRun
+
+COUNTERS = [
+    "api_calls",
+    "pages_fetched",
+    "posts_seen",
+    "posts_new",
+    "posts_ignored",
+    "head_requests",
+    "cache_hits",
+    "db_queries",
+    "rows_inserted",
+    "errors",
+]
+STAGES = ["fetch", "prepare", "commit"]
+
+current_stats = contextvars.ContextVar("current_stats", default=None)
+
+
+class ListingStats:
+    """Counters and stage timings of one listing, shared by the stage threads."""
+
+    def __init__(self, subreddit, listing: str, time_frame: str, job=None):
+        self.subreddit = subreddit
+        self.listing = listing
+        self.time_frame = time_frame
+        self.job = job
+        self.started_on = timezone.now()
+        self.started = time.monotonic()
+        self.counts = Counter()
+        self.seconds = Counter()
+        self.last_error = ""
+        self.lock = threading.Lock()
+
+    def add(self, counter: str, amount: int = 1):
+        with self.lock:
+            self.counts[counter] += amount
+
+    def error(self, error: Exception):
+        with self.lock:
+            self.counts["errors"] += 1
+            self.last_error = str(error)
+
+    def run(self, stage: str, func, *args):
+        """Calls `func` with this listing as the current one, timing it as `stage`."""
+        token = current_stats.set(self)
+        start = time.monotonic()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.monotonic() - start
+            current_stats.reset(token)
+            with self.lock:
+                self.seconds[stage] += elapsed
+
+    def save(self) -> SyncRun:
+        return SyncRun.objects.create(
+            subreddit=self.subreddit,
+            job=self.job,
+            listing=self.listing,
+            time_frame=self.time_frame,
+            started_on=self.started_on,
+            duration=time.monotonic() - self.started,
+            last_error=self.last_error[:2000],
+            **{f"{stage}_seconds": self.seconds[stage] for stage in STAGES},
+            **{counter: self.counts[counter] for counter in COUNTERS},
+        )
+
+
+def record(counter: str, amount: int = 1):
+    """Adds to a counter of the listing the current thread works for, if any."""
+    stats = current_stats.get()
+    if stats is not None:
+        stats.add(counter, amount)
+
+
+def count_query(execute, sql, params, many, context):
+    record("db_queries")
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def attach_query_counter(sender, connection, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
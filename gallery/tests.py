@@ -1,3 +1,871 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import praw
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import (
+    Category,
+    Deleted,
+    Gallery,
+    IgnoredPosts,
+    Image,
+    ImageCounter,
+    Post,
+    RedditCredential,
+    SubReddit,
+    SyncJob,
+    SyncRun,
+    ValidatedUrl,
+)
+from .clients import DEFAULT_QUOTA, ClientPool
+from .fetcher import sync_subreddits
+from .listing import parse_listing
+from .management.commands.bench_parse import FIXTURE, comparable
+from .membership import KnownPosts
+from .pagination import decode_cursor, encode_cursor, keyset_page
+from .scheduler import plan_sync
+from .signals import Recount
+from .thumbnails import ThumbnailCache
+from .utils import iter_listing_pages, submission_to_dict, write_page
+from .validation import ImageValidator
+
+NO_CACHE = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+LOCAL_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def create_images(
+    subreddit: SubReddit, numbers, posts=False, galleries=False, gallery=None
+) -> list:
+    """
+    Images `p<number>` of a subreddit, created oldest first.
+    :param posts: Give every image a post of its own.
+    :param galleries: Put every odd image in a gallery of its post.
+    :param gallery: Gallery every image belongs to.
+    """
+    images = []
+    for number in numbers:
+        post = None
+        if posts or galleries:
+            post = Post.objects.create(
+                subreddit=subreddit,
+                reddit_id=f"p{number}",
+                title=f"Post {number}",
+                author="someone",
+            )
+        image_gallery = gallery
+        if galleries and number % 2:
+            image_gallery = Gallery.objects.create(
+                post_ref=post,
+                subreddit=subreddit,
+                reddit_id=f"g{number}",
+                link=f"https://www.reddit.com/gallery/g{number}",
+            )
+        images.append(
+            Image.objects.create(
+                post_ref=post,
+                subreddit=subreddit,
+                gallery=image_gallery,
+                reddit_id=f"p{number}",
+                link=f"https://i.redd.it/{number}.jpg",
+            )
+        )
+    return images
+
+
+@override_settings(GALLERY_PAGE_SIZE=10, CACHES=NO_CACHE)
+class GalleryCardQueriesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.subreddit = SubReddit.objects.create(sub_reddit="pics")
+        create_images(cls.subreddit, range(12), galleries=True)
+
+    def test_cards_page_is_one_query(self):
+        url = reverse("gallery_cards")
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertContains(response, 'class="col"', count=10)
+        self.assertContains(response, "Post 11")
+        self.assertTrue(response.has_header("X-Next-Page"))
+
+    def test_queries_do_not_grow_with_the_page(self):
+        url = reverse("gallery_cards")
+        with override_settings(GALLERY_PAGE_SIZE=2):
+            with self.assertNumQueries(1):
+                self.client.get(url)
+        with self.assertNumQueries(1):
+            self.client.get(url)
+
+    def test_bad_subreddit_is_404(self):
+        url = reverse("gallery_cards")
+        self.assertEqual(self.client.get(url + "?sub=abc").status_code, 404)
+        self.assertEqual(self.client.get(url + "?sub=999999").status_code, 404)
+
+    def test_subreddit_page(self):
+        url = reverse("folder_view_detail", args=[self.subreddit.pk])
+        # Subreddit, cards, image count, newest image, categories and sidebar.
+        with self.assertNumQueries(6):
+            response = self.client.get(url)
+        self.assertContains(response, "Post 11")
+
+
+@override_settings(CACHES=NO_CACHE)
+class ImageApiQueriesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        subreddit = SubReddit.objects.create(sub_reddit="pics")
+        gallery = Gallery.objects.create(subreddit=subreddit, reddit_id="g1")
+        cls.images = create_images(subreddit, range(12), gallery=gallery)
+        Deleted.objects.create(image=cls.images[3], reddit_id="p3")
+
+    def test_list_is_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("image_viewset-list"))
+        deleted = {image["id"]: image["check_deleted"] for image in response.json()}
+        self.assertEqual(len(deleted), 12)
+        self.assertTrue(deleted[self.images[3].pk])
+        self.assertEqual(sum(deleted.values()), 1)
+
+    def test_detail_is_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                reverse("image_viewset-detail", args=[self.images[3].pk])
+            )
+        self.assertTrue(response.json()["check_deleted"])
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class FolderDashboardTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.subreddits = [
+            SubReddit.objects.create(sub_reddit=f"sub{number}") for number in range(6)
+        ]
+        for number in range(3):
+            category = Category.objects.create(name=f"Category {number}")
+            category.subreddits.set(cls.subreddits[number : number + 3])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_membership_queries_are_fixed(self):
+        url = reverse("folder_view")
+        with self.assertNumQueries(9):
+            self.client.get(url)
+        category = Category.objects.create(name="Bigger")
+        category.subreddits.set(self.subreddits[:5])
+        with self.assertNumQueries(9):
+            response = self.client.get(url)
+        self.assertContains(response, "5 items")
+
+    def test_cached_blocks(self):
+        url = reverse("folder_view")
+        self.client.get(url)
+        # Only the image total, sync jobs and telemetry are read again.
+        with self.assertNumQueries(4):
+            self.client.get(url)
+
+    def test_settings_form_invalidates(self):
+        url = reverse("folder_view")
+        category = Category.objects.create(name="Moved")
+        self.assertContains(self.client.get(url), "0 items")
+        self.client.post(
+            reverse("folder_settings"),
+            {
+                "folder_id": self.subreddits[5].pk,
+                "sub_display_name": self.subreddits[5].sub_reddit,
+                "categories": [category.pk],
+            },
+            headers={"X-Requested-With": "XMLHttpRequest"},
+        )
+        self.assertContains(self.client.get(url), "1 items")
+
+    def test_exclude_invalidates(self):
+        url = reverse("folder_view")
+        self.client.get(url)
+        self.client.post(
+            reverse("folder_options"), {"pk": self.subreddits[0].pk, "excluded": ""}
+        )
+        with self.assertNumQueries(9):
+            self.client.get(url)
+
+    def test_sync_telemetry(self):
+        for listing in ("new", "hot"):
+            SyncRun.objects.create(
+                subreddit=self.subreddits[0],
+                listing=listing,
+                time_frame="day",
+                started_on=timezone.now(),
+                posts_seen=100,
+                posts_new=7,
+                posts_ignored=3,
+                rows_inserted=19,
+            )
+        totals, subreddits = SyncRun.summary()
+        self.assertEqual(totals["posts_ignored"], 6)
+        self.assertEqual(totals["rows_inserted"], 38)
+        self.assertEqual(subreddits[0]["posts_ignored"], 6)
+        response = self.client.get(reverse("folder_view"))
+        self.assertContains(response, "38 rows inserted")
+        self.assertContains(response, "14 new, 6 ignored of 200 posts")
+
+    def test_record_sync_keeps_cache(self):
+        url = reverse("folder_view")
+        self.client.get(url)
+        self.subreddits[0].record_sync(3)
+        with self.assertNumQueries(4):
+            self.client.get(url)
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class ResponseCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.subreddit = SubReddit.objects.create(sub_reddit="pics")
+        cls.other = SubReddit.objects.create(sub_reddit="art")
+        create_images(cls.subreddit, range(3))
+        ImageCounter.recount()
+
+    def setUp(self):
+        cache.clear()
+
+    def add_image(self, subreddit, number):
+        image = Image.objects.create(
+            subreddit=subreddit,
+            reddit_id=f"n{number}",
+            link=f"https://i.redd.it/n{number}.jpg",
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            ImageCounter.add(subreddit, 1, image.pk, image.date_added)
+
+    def test_cards_are_cached_until_a_write(self):
+        url = reverse("gallery_cards") + f"?sub={self.subreddit.pk}"
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            cached = self.client.get(url)
+        self.assertContains(cached, 'class="col"', count=3)
+        self.add_image(self.other, 1)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+        self.add_image(self.subreddit, 2)
+        self.assertContains(self.client.get(url), 'class="col"', count=4)
+
+    def test_api_list(self):
+        url = reverse("image_viewset-list")
+        self.assertEqual(len(self.client.get(url).json()), 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.client.get(url).json()), 3)
+        self.add_image(self.other, 1)
+        self.assertEqual(len(self.client.get(url).json()), 4)
+
+    def test_api_delete(self):
+        url = reverse("image_viewset-list")
+        self.assertEqual(len(self.client.get(url).json()), 3)
+        cards = reverse("gallery_cards") + f"?sub={self.subreddit.pk}"
+        self.client.get(cards)
+        image = Image.objects.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(
+                reverse("image_viewset-detail", args=[image.pk])
+            )
+        self.assertEqual(response.status_code, 204)
+        ids = [row["id"] for row in self.client.get(url).json()]
+        self.assertEqual(len(ids), 2)
+        self.assertNotIn(image.pk, ids)
+        self.assertContains(self.client.get(cards), 'class="col"', count=2)
+        self.assertEqual(ImageCounter.total(), 2)
+
+    def test_pages_need_the_csrf_cookie(self):
+        url = reverse("folder_view_detail", args=[self.subreddit.pk])
+        response = self.client.get(url)
+        self.client.get(url)
+        self.assertIn("csrftoken", response.cookies)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+
+class ImageCounterTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.subreddits = [
+            SubReddit.objects.create(sub_reddit=name) for name in ("pics", "art")
+        ]
+        # Even images in the first subreddit, odd ones in the second.
+        create_images(cls.subreddits[0], range(0, 6, 2), posts=True)
+        create_images(cls.subreddits[1], range(1, 6, 2), posts=True)
+        ImageCounter.recount()
+
+    def counts(self) -> list:
+        return [
+            ImageCounter.objects.get(subreddit=subreddit).images
+            for subreddit in self.subreddits
+        ]
+
+    def test_deletes_recount_once(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Image.objects.filter(reddit_id__in=["p0", "p1", "p2"]).delete()
+        recounts = [func for func in callbacks if isinstance(func, Recount)]
+        self.assertEqual(len(recounts), 1)
+        self.assertEqual(self.counts(), [1, 2])
+
+    def test_cascade_recounts(self):
+        newest = Image.objects.get(reddit_id="p4")
+        self.assertEqual(
+            ImageCounter.objects.get(subreddit=self.subreddits[0]).newest_image, newest
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.get(reddit_id="p4").delete()
+        counter = ImageCounter.objects.get(subreddit=self.subreddits[0])
+        self.assertEqual(counter.images, 2)
+        self.assertEqual(counter.newest_image.reddit_id, "p2")
+
+    def test_add_keeps_the_newest_image(self):
+        counter = ImageCounter.objects.get(subreddit=self.subreddits[0])
+        older = Image.objects.get(reddit_id="p0")
+        ImageCounter.add(self.subreddits[0], 1, older.pk, older.date_added)
+        counter.refresh_from_db()
+        self.assertEqual(counter.images, 4)
+        self.assertEqual(counter.newest_image.reddit_id, "p4")
+        newer = Image.objects.create(
+            subreddit=self.subreddits[0], reddit_id="p6", link="https://i.redd.it/6.jpg"
+        )
+        ImageCounter.add(self.subreddits[0], 1, newer.pk, newer.date_added)
+        counter.refresh_from_db()
+        self.assertEqual(counter.images, 5)
+        self.assertEqual(counter.newest_image, newer)
+        self.assertEqual(counter.newest_added, newer.date_added)
+
+
+def prepared_page(start: int, posts: int, galleries: int, ignored: int) -> list:
+    """A page as `prepare_posts` returns it, ids start at `start`."""
+    page = []
+    for number in range(start, start + posts + galleries + ignored):
+        post = {
+            "id": f"w{number}",
+            "title": f"Post {number}",
+            "content": "",
+            "perma_url": f"https://www.reddit.com/r/pics/comments/w{number}/",
+            "url": f"https://i.redd.it/w{number}.jpg",
+            "score": number,
+            "author": "someone",
+        }
+        if number < start + posts:
+            images = [
+                {
+                    "url": post["url"],
+                    "reddit_id": post["url"],
+                    "gallery": False,
+                    "preview": None,
+                }
+            ]
+        elif number < start + posts + galleries:
+            post["url"] = f"https://www.reddit.com/gallery/w{number}"
+            images = [
+                {
+                    "url": f"https://i.redd.it/w{number}-{item}.jpg",
+                    "reddit_id": f"w{number}",
+                    "gallery": True,
+                    "preview": {"width": 640, "height": 480, "variants": []},
+                }
+                for item in range(2)
+            ]
+        else:
+            images = []
+        page.append({"post": post, "images": images})
+    return page
+
+
+@override_settings(CACHES=NO_CACHE)
+class WritePageTest(TestCase):
+    # Savepoint, ignored posts, posts, post ids, galleries, gallery ids,
+    # images, added images, counter and release.
+    QUERIES = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subreddit = SubReddit.objects.create(sub_reddit="pics")
+        ImageCounter.recount()
+
+    def test_page_queries_are_fixed(self):
+        with self.assertNumQueries(self.QUERIES):
+            write_page(prepared_page(0, 3, 1, 1), self.subreddit)
+        with self.assertNumQueries(self.QUERIES):
+            write_page(prepared_page(100, 30, 10, 10), self.subreddit)
+        self.assertEqual(Post.objects.count(), 44)
+        self.assertEqual(Gallery.objects.count(), 11)
+        self.assertEqual(Image.objects.count(), 55)
+        self.assertEqual(IgnoredPosts.objects.count(), 11)
+        self.assertEqual(ImageCounter.total(), 55)
+        gallery_images = Image.objects.filter(gallery__reddit_id="w3")
+        self.assertEqual(gallery_images.count(), 2)
+        self.assertEqual(
+            set(gallery_images.values_list("post_ref__reddit_id", flat=True)), {"w3"}
+        )
+
+    def test_duplicates_are_ignored(self):
+        write_page(prepared_page(0, 3, 1, 1), self.subreddit)
+        with self.assertNumQueries(self.QUERIES - 1):
+            # Nothing was added, the counter isn't touched.
+            write_page(prepared_page(0, 3, 1, 1), self.subreddit)
+        self.assertEqual(Post.objects.count(), 4)
+        self.assertEqual(Gallery.objects.count(), 1)
+        self.assertEqual(Image.objects.count(), 5)
+        self.assertEqual(IgnoredPosts.objects.count(), 1)
+        self.assertEqual(ImageCounter.total(), 5)
+
+    def test_ignored_only_page(self):
+        with self.assertNumQueries(3):
+            write_page(prepared_page(0, 0, 0, 4), self.subreddit)
+        self.assertEqual(IgnoredPosts.objects.count(), 4)
+        self.assertFalse(Post.objects.exists())
+
+
+def listing_page(created: list, after: str = None) -> dict:
+    """Raw listing JSON of posts with the given `created_utc`."""
+    children = [
+        {
+            "kind": "t3",
+            "data": {
+                "id": f"l{int(stamp)}",
+                "title": "Post",
+                "selftext": "",
+                "score": 1,
+                "author": "someone",
+                "url": f"https://i.redd.it/l{int(stamp)}.jpg",
+                "permalink": f"r/pics/comments/l{int(stamp)}/",
+                "created_utc": stamp,
+            },
+        }
+        for stamp in created
+    ]
+    return {"data": {"children": children, "after": after}}
+
+
+class IterListingPagesTest(SimpleTestCase):
+    def listing(self, pages: list, type_: str, since: float = None) -> tuple:
+        """Runs a listing over canned pages, returns (posts per page, requests)."""
+        client = mock.Mock()
+        client.request.side_effect = pages
+        with mock.patch("gallery.utils.get_client", return_value=client):
+            yielded = list(iter_listing_pages("pics", "day", type_, since=since))
+        created = [[post["created"] for post in page] for page in yielded]
+        return created, client.request.call_count
+
+    def test_new_stops_at_the_first_seen_post(self):
+        pages = [
+            listing_page([110, 109, 108], "t3_a"),
+            listing_page([107, 100, 99], "t3_b"),
+            listing_page([98, 97], None),
+        ]
+        created, requests = self.listing(pages, "new", since=100)
+        self.assertEqual(created, [[110, 109, 108], [107]])
+        self.assertEqual(requests, 2)
+
+    def test_other_listings_stop_after_a_page_without_new_posts(self):
+        pages = [
+            listing_page([90, 120, 80], "t3_a"),
+            listing_page([70, 60], "t3_b"),
+            listing_page([130], None),
+        ]
+        created, requests = self.listing(pages, "top", since=100)
+        self.assertEqual(created, [[90, 120, 80], [70, 60]])
+        self.assertEqual(requests, 2)
+
+    def test_without_since_every_page_is_fetched(self):
+        pages = [listing_page([90], "t3_a"), listing_page([80], None)]
+        created, requests = self.listing(pages, "new")
+        self.assertEqual(created, [[90], [80]])
+        self.assertEqual(requests, 2)
+
+
+@mock.patch("gallery.fetcher.finish_subreddit")
+@mock.patch("gallery.fetcher.save_subreddit_info")
+@mock.patch("gallery.fetcher.get_subreddit_about")
+@mock.patch("gallery.fetcher.prepare_page", side_effect=lambda posts, known: posts)
+@mock.patch("gallery.fetcher.finish_listing")
+class SyncCursorTest(SimpleTestCase):
+    def sync(self, finish_listing, commit_page) -> list:
+        """Syncs every listing over the same two posts, returns `advance` of each."""
+        subreddit = SubReddit(id=1, sub_reddit="pics")
+        posts = [{"id": f"s{number}", "created": number} for number in range(2)]
+        with mock.patch(
+            "gallery.fetcher.iter_listing_pages",
+            side_effect=lambda *args, **kwargs: iter([list(posts)]),
+        ), mock.patch("gallery.fetcher.commit_page", commit_page):
+            asyncio.run(sync_subreddits([subreddit], {}, None, 2, 1))
+        return [call.args[1] for call in finish_listing.call_args_list]
+
+    def test_cursors_advance(self, finish_listing, *mocks):
+        advanced = self.sync(finish_listing, mock.Mock())
+        self.assertTrue(advanced)
+        self.assertTrue(all(advanced))
+
+    def test_failed_write_keeps_every_cursor(self, finish_listing, *mocks):
+        # Only the first listing hands the posts to the writer, the others
+        # skip them, so none of them may move past the lost posts.
+        advanced = self.sync(finish_listing, mock.Mock(side_effect=OSError("down")))
+        self.assertTrue(advanced)
+        self.assertFalse(any(advanced))
+
+
+@override_settings(GALLERY_PAGE_SIZE=2)
+class CursorTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        subreddit = SubReddit.objects.create(sub_reddit="pics")
+        cls.images = create_images(subreddit, range(5))
+
+    def test_malformed_cursors(self):
+        def encoded(text: bytes) -> str:
+            return base64.urlsafe_b64encode(text).decode().rstrip("=")
+
+        for cursor in (
+            "",
+            "!!!",
+            "abc",
+            encoded(b"no separator"),
+            encoded(b"2024-01-01T00:00:00|x"),
+            encoded(b"yesterday|1"),
+            encoded(b"2024-01-01T00:00:00|1|2"),
+            encoded(b"\xff\xfe|1"),
+        ):
+            with self.subTest(cursor=cursor):
+                self.assertIsNone(decode_cursor(cursor))
+
+    def test_round_trip(self):
+        image = self.images[2]
+        self.assertEqual(
+            decode_cursor(encode_cursor(image)), (image.date_added, image.pk)
+        )
+
+    def test_pages_cover_every_image_once(self):
+        seen = []
+        page, cursor = keyset_page(Image.objects.all())
+        seen.extend(page)
+        while cursor:
+            page, cursor = keyset_page(Image.objects.all(), cursor)
+            seen.extend(page)
+        newest_first = [image.pk for image in reversed(self.images)]
+        self.assertEqual([image.pk for image in seen], newest_first)
+
+    def test_bad_cursor_is_the_first_page(self):
+        first, _ = keyset_page(Image.objects.all())
+        page, cursor = keyset_page(Image.objects.all(), "not-a-cursor")
+        self.assertEqual(page, first)
+        self.assertIsNotNone(cursor)
+        response = self.client.get(reverse("gallery_cards") + "?after=not-a-cursor")
+        self.assertEqual(response.status_code, 200)
+
+
+class ThumbnailCacheTest(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.thumbnails = ThumbnailCache(
+            root=root.name, width=320, image_format="webp", max_bytes=1024 * 1024
+        )
+        self.image = SimpleNamespace(link="https://i.redd.it/a.jpg")
+
+    def get_at_once(self, render, threads: int = 8) -> list:
+        """Asks for the same thumbnail from several threads at once."""
+        results = []
+        start = threading.Barrier(threads)
+
+        def get():
+            start.wait()
+            results.append(self.thumbnails.get(self.image))
+
+        def slow_render(image):
+            time.sleep(0.05)
+            return render(image)
+
+        with mock.patch.object(self.thumbnails, "render", side_effect=slow_render):
+            workers = [threading.Thread(target=get) for _ in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            self.renders = self.thumbnails.render.call_count
+        return results
+
+    def test_made_once(self):
+        results = self.get_at_once(lambda image: b"thumbnail")
+        self.assertEqual(self.renders, 1)
+        self.assertEqual(set(results), {self.thumbnails.path(self.image)})
+        self.assertEqual(self.thumbnails.key_locks, {})
+
+    def test_lock_outlives_its_waiters(self):
+        path = self.thumbnails.path(self.image)
+        lock = self.thumbnails.key_lock(path)
+        waiter = self.thumbnails.key_lock(path)
+        self.assertIs(waiter, lock)
+        self.thumbnails.release_key_lock(path, lock)
+        # A thread arriving now must queue behind the waiter, not make its own.
+        self.assertIs(self.thumbnails.key_lock(path), lock)
+        self.thumbnails.release_key_lock(path, lock)
+        self.thumbnails.release_key_lock(path, lock)
+        self.assertEqual(self.thumbnails.key_locks, {})
+
+    def test_failure_is_remembered(self):
+        results = self.get_at_once(lambda image: None)
+        self.assertEqual(self.renders, 1)
+        self.assertEqual(set(results), {None})
+        self.assertEqual(self.thumbnails.key_locks, {})
+        self.assertIn(self.thumbnails.path(self.image), self.thumbnails.failed)
+
+
+def probed(is_good: bool, cacheable: bool = True) -> dict:
+    """A network answer as `ImageValidator.probe` returns it."""
+    return {
+        "is_good": is_good,
+        "status_code": 200,
+        "content_type": "image/jpeg" if is_good else "text/html",
+        "redirect_to": "",
+        "cacheable": cacheable,
+        "requests": 1,
+    }
+
+
+@override_settings(VALIDATION_CACHE_TTL=3600)
+class ValidationCacheTest(TestCase):
+    def setUp(self):
+        self.validator = ImageValidator(workers=2, per_host=2)
+        self.addCleanup(self.validator.executor.shutdown)
+
+    def validate(self, urls: list, answer: dict = None) -> tuple:
+        """Validates `urls`, returns (verdicts, URLs that went to the network)."""
+        with mock.patch.object(
+            self.validator, "probe", return_value=answer or probed(True)
+        ) as probe:
+            verdicts = self.validator.validate_many(urls)
+        return verdicts, sorted(call.args[0] for call in probe.call_args_list)
+
+    def test_hit_skips_the_network(self):
+        url = "https://i.redd.it/a.jpg"
+        self.assertEqual(self.validate([url]), ({url: True}, [url]))
+        self.assertEqual(self.validate([url], probed(False)), ({url: True}, []))
+
+    def test_spellings_share_the_entry(self):
+        self.validate(["https://a.com/x.jpg"])
+        urls = ["https://A.com/x.jpg", "https://a.com/x.jpg#frag"]
+        verdicts, network = self.validate(urls)
+        self.assertEqual(verdicts, dict.fromkeys(urls, True))
+        self.assertEqual(network, [])
+
+    def test_stale_entries_are_checked_again(self):
+        url = "https://i.redd.it/a.jpg"
+        self.validate([url])
+        ValidatedUrl.objects.update(
+            checked_at=timezone.now() - timedelta(seconds=3601)
+        )
+        self.assertEqual(self.validate([url], probed(False)), ({url: False}, [url]))
+        self.assertEqual(self.validate([url])[1], [])
+
+    def test_uncacheable_answers_are_not_stored(self):
+        url = "https://i.redd.it/a.jpg"
+        self.validate([url], probed(True, cacheable=False))
+        self.assertFalse(ValidatedUrl.objects.exists())
+
+    @override_settings(VALIDATION_CACHE_TTL=0)
+    def test_cache_off(self):
+        url = "https://i.redd.it/a.jpg"
+        self.validate([url])
+        self.assertEqual(self.validate([url])[1], [url])
+
+
+class KnownPostsTest(TestCase):
+    def test_membership(self):
+        known = KnownPosts()
+        known.update(["1abcde", "0a", "A", "1_0", "https://i.redd.it/x.jpg", ""])
+        for reddit_id in ("1abcde", "0a", "A", "1_0", "https://i.redd.it/x.jpg", ""):
+            self.assertIn(reddit_id, known)
+        # Ids that parse to the same int as a stored one aren't mixed up.
+        for reddit_id in ("a", "00a", "10", "1ABCDE", "1abcdf", " 1abcde"):
+            self.assertNotIn(reddit_id, known)
+        self.assertEqual(len(known), 6)
+
+    def test_load(self):
+        subreddit = SubReddit.objects.create(sub_reddit="pics")
+        Post.objects.create(subreddit=subreddit, reddit_id="abc", title="Post")
+        IgnoredPosts.objects.create(reddit_id="0def")
+        known = KnownPosts.load()
+        self.assertIn("abc", known)
+        self.assertIn("0def", known)
+        self.assertNotIn("def", known)
+        self.assertEqual(len(known), 2)
+
+
+class SyncJobTest(TestCase):
+    def test_claim_hands_out_each_job_once(self):
+        subreddit = SubReddit.objects.create(sub_reddit="pics")
+        first = SyncJob.enqueue(subreddit=subreddit)
+        second = SyncJob.enqueue()
+        claimed = SyncJob.claim("worker-1")
+        self.assertEqual(claimed, first)
+        self.assertEqual(claimed.state, SyncJob.RUNNING)
+        self.assertEqual(claimed.worker, "worker-1")
+        self.assertIsNotNone(claimed.started_on)
+        self.assertEqual(SyncJob.claim("worker-2"), second)
+        self.assertIsNone(SyncJob.claim("worker-3"))
+        self.assertEqual(
+            list(SyncJob.objects.values_list("worker", flat=True).order_by("id")),
+            ["worker-1", "worker-2"],
+        )
+
+    def test_finished_jobs_are_not_claimed(self):
+        SyncJob.objects.create(state=SyncJob.DONE)
+        SyncJob.objects.create(state=SyncJob.FAILED)
+        self.assertIsNone(SyncJob.claim("worker-1"))
+
+
+class ParseListingTest(SimpleTestCase):
+    def test_agrees_with_praw(self):
+        with open(FIXTURE) as f:
+            listing = json.load(f)["listing"]
+        # Never sends a request, submissions are built from the fixture's data.
+        client = praw.Reddit(
+            client_id="test",
+            client_secret="test",
+            user_agent="test",
+            check_for_updates=False,
+        )
+        expected = [
+            submission_to_dict(praw.models.Submission.parse(child["data"], client))
+            for child in listing["data"]["children"]
+        ]
+        posts, after = parse_listing(listing)
+        self.assertEqual(
+            [comparable(post) for post in posts],
+            [comparable(post) for post in expected],
+        )
+        self.assertEqual(after, listing["data"]["after"])
+        self.assertTrue(any("media_meta" in post for post in posts))
+        self.assertTrue(any("preview" in post for post in posts))
+
+
+@override_settings(SYNC_MIN_EXPECTED_POSTS=1, SYNC_MAX_INTERVAL_HOURS=24)
+class PlanSyncTest(TestCase):
+    def setUp(self):
+        self.start = timezone.now() - timedelta(days=2)
+
+    def synced(self, name: str, *new_posts: int) -> SubReddit:
+        """A subreddit synced hourly from `start`, finding `new_posts` each time."""
+        subreddit = SubReddit.objects.create(sub_reddit=name)
+        for hour, posts in enumerate(new_posts):
+            subreddit.record_sync(posts, self.start + timedelta(hours=hour))
+        return subreddit
+
+    def test_record_sync_smooths_the_rate(self):
+        subreddit = self.synced("pics", 0, 10, 0)
+        # Unknown after the first sync, then 10/h, then halfway to 0/h.
+        self.assertEqual(subreddit.post_rate, 5)
+        self.assertEqual(subreddit.last_new_posts, 0)
+        subreddit.refresh_from_db()
+        self.assertEqual(subreddit.updated_on, self.start + timedelta(hours=2))
+
+    def test_quiet_subreddits_wait(self):
+        quiet = self.synced("quiet", 0, 0)
+        busy = self.synced("busy", 0, 30)
+        fresh = SubReddit.objects.create(sub_reddit="fresh")
+        now = self.start + timedelta(hours=3)
+        self.assertEqual(plan_sync([quiet, busy, fresh], now=now), [fresh, busy])
+        self.assertEqual(
+            plan_sync([quiet, busy, fresh], everything=True, now=now),
+            [fresh, busy, quiet],
+        )
+        # However quiet, a subreddit is synced once the interval has passed.
+        later = self.start + timedelta(hours=26)
+        self.assertIn(quiet, plan_sync([quiet], now=later))
+
+
+def rate_limited(remaining: float, reset: float = 600):
+    """A response carrying Reddit's rate limit headers."""
+    return SimpleNamespace(
+        headers={
+            "x-ratelimit-remaining": str(remaining),
+            "x-ratelimit-reset": str(reset),
+            "x-ratelimit-used": "0",
+        }
+    )
+
+
+@override_settings(CLIENT_ID="main", CLIENT_SECRET="secret", USER_AGENT="agent")
+class ClientPoolTest(TestCase):
+    def setUp(self):
+        RedditCredential.objects.create(client_id="extra", client_secret="secret")
+        RedditCredential.objects.create(client_id="off", is_active=False)
+        self.pool = ClientPool()
+        self.pool.load()
+        self.main, self.extra = self.pool.quotas["main"], self.pool.quotas["extra"]
+
+    def answer(self, quota, response):
+        quota.acquire()
+        quota.release(response)
+
+    def test_active_apps_are_loaded(self):
+        self.assertEqual(list(self.pool.quotas), ["main", "extra"])
+
+    def test_picks_the_most_quota_left(self):
+        self.answer(self.main, rate_limited(10))
+        self.answer(self.extra, rate_limited(500))
+        self.assertIs(self.pool.pick(), self.extra)
+        self.answer(self.extra, rate_limited(5))
+        self.assertIs(self.pool.pick(), self.main)
+
+    def test_requests_in_flight_count(self):
+        self.answer(self.main, rate_limited(100))
+        self.answer(self.extra, rate_limited(101))
+        self.extra.acquire()
+        self.extra.acquire()
+        self.assertIs(self.pool.pick(), self.main)
+        self.extra.release()
+        self.extra.release()
+        self.assertIs(self.pool.pick(), self.extra)
+
+    def test_window_reset(self):
+        self.answer(self.main, rate_limited(1, reset=0))
+        self.answer(self.extra, rate_limited(500))
+        # Past its reset the main app has its full quota again.
+        self.assertEqual(self.main.headroom(), DEFAULT_QUOTA)
+        self.assertIs(self.pool.pick(), self.main)
+
+
+class VariantUrlTest(SimpleTestCase):
+    def image(self, widths: list) -> Image:
+        return Image(
+            link="https://i.redd.it/full.jpg",
+            variants=[
+                {"url": f"https://preview.redd.it/{width}.jpg", "width": width}
+                for width in widths
+            ],
+        )
+
+    def test_smallest_that_fits(self):
+        image = self.image([1080, 216, 640, 320])
+        self.assertEqual(image.variant_url(300), "https://preview.redd.it/320.jpg")
+        self.assertEqual(image.variant_url(320), "https://preview.redd.it/320.jpg")
+        self.assertEqual(image.variant_url(10), "https://preview.redd.it/216.jpg")
+
+    def test_largest_when_none_fits(self):
+        image = self.image([216, 640])
+        self.assertEqual(image.variant_url(2000), "https://preview.redd.it/640.jpg")
+
+    def test_original_without_variants(self):
+        self.assertEqual(self.image([]).variant_url(320), "https://i.redd.it/full.jpg")
+        image = Image(link="https://i.redd.it/full.jpg", variants=[{"url": "x"}])
+        self.assertEqual(image.variant_url(320), "https://i.redd.it/full.jpg")
+
+    @override_settings(CARD_IMAGE_WIDTH=600)
+    def test_thumbnail_url(self):
+        image = self.image([320, 640, 1080])
+        self.assertEqual(image.thumbnail_url, "https://preview.redd.it/640.jpg")
@@ -0,0 +1,286 @@
+"""
+Local thumbnail cache.
+Gallery cards are served small WebP/JPEG thumbnails made with Pillow from the
+smallest fitting preview of each image, instead of hotlinking the image hosts.
+A thumbnail is made on its first request, or ahead of time by
+`manage.py make_thumbnails` and by the sync worker after each job.
+Files live in `THUMBNAIL_DIR`, sharded by the hash of the image link into
+`ab/cd/<hash>-<width>.<format>` so no directory grows too large. The directory
+is capped at `THUMBNAIL_CACHE_MB`, the least recently served files go first.
+"""
+
+import io
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from PIL import Image as PILImage
+from PIL import ImageOps
+
+from .validation import HEADERS, url_hash
+
+FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg")}
+# Nothing Pillow can open is this big, larger answers are dropped mid-download.
+MAX_SOURCE_BYTES = 25 * 1024 * 1024
+VIDEO_EXTENSIONS = (".mp4", ".webm", ".mov")
+# A served file's mtime is its LRU position, it's refreshed at most this often
+# so a busy page isn't a disk write per card.
+TOUCH_INTERVAL = 3600
+# Sources that couldn't be made into a thumbnail aren't retried for this long.
+RETRY_AFTER = 3600
+# Expired failures are swept from memory once there are this many entries.
+FAILED_PRUNE_AT = 10000
+# Eviction trims the cache down to this fraction of the cap.
+EVICT_TO = 0.9
+
+
+class ThumbnailCache:
+    def __init__(
+        self,
+        root=None,
+        width: int = None,
+        image_format: str = None,
+        max_bytes: int = None,
+        timeout: int = 10,
+    ):
+        self.root = os.fspath(root or settings.THUMBNAIL_DIR)
+        self.width = width or settings.CARD_IMAGE_WIDTH
+        self.format = (image_format or settings.THUMBNAIL_FORMAT).lower()
+        if self.format not in FORMATS:
+            raise ValueError(f"Unknown thumbnail format {self.format}")
+        self.max_bytes = max_bytes or settings.THUMBNAIL_CACHE_MB * 1024 * 1024
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        self.size = None
+        self.failed = {}
+        self.key_locks = {}
+        self.lock = threading.Lock()
+
+    @property
+    def content_type(self) -> str:
+        return FORMATS[self.format][1]
+
+    def path(self, image) -> str:
+        key = url_hash(image.link)
+        return os.path.join(
+            self.root, key[:2], key[2:4], f"{key}-{self.width}.{self.format}"
+        )
+
+    def key_lock(self, path: str) -> threading.Lock:
+        """Lock of one thumbnail, held by every thread that wants it made."""
+        with self.lock:
+            entry = self.key_locks.get(path)
+            if entry is None:
+                entry = self.key_locks[path] = [threading.Lock(), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def release_key_lock(self, path: str, lock: threading.Lock):
+        """Drops the lock once no thread holds or waits for it."""
+        with self.lock:
+            entry = self.key_locks.get(path)
+            if entry is None or entry[0] is not lock:
+                return
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.key_locks[path]
+
+    def get(self, image):
+        """
+        Path of the image's thumbnail, made now if there isn't one yet.
+        :param image: models.Image
+        :return: Path of the file, None if the image can't be thumbnailed.
+        """
+        path = self.path(image)
+        if self.touch(path):
+            return path
+        lock = self.key_lock(path)
+        try:
+            with lock:
+                # Another thread may have made it while this one waited.
+                if os.path.exists(path):
+                    return path
+                if self.recently_failed(path):
+                    return None
+                data = self.render(image)
+                if data is None:
+                    with self.lock:
+                        self.failed[path] = time.time()
+                    return None
+                self.write(path, data)
+            return path
+        finally:
+            self.release_key_lock(path, lock)
+
+    def recently_failed(self, path: str) -> bool:
+        """Whether the path failed within `RETRY_AFTER`, older failures are dropped."""
+        now = time.time()
+        with self.lock:
+            if path in self.failed and now - self.failed[path] >= RETRY_AFTER:
+                del self.failed[path]
+            if len(self.failed) > FAILED_PRUNE_AT:
+                self.failed = {
+                    key: failed_at
+                    for key, failed_at in self.failed.items()
+                    if now - failed_at < RETRY_AFTER
+                }
+            return path in self.failed
+
+    def touch(self, path: str) -> bool:
+        """Moves an existing thumbnail to the front of the LRU order."""
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return False
+        now = time.time()
+        if now - mtime > TOUCH_INTERVAL:
+            try:
+                os.utime(path, (now, now))
+            except OSError:
+                ...
+        return True
+
+    def fetch(self, url: str):
+        """Downloads a source image, None if it's missing or too big."""
+        try:
+            with self.session.get(url, timeout=self.timeout, stream=True) as response:
+                if response.status_code != 200:
+                    return None
+                if int(response.headers.get("Content-Length") or 0) > MAX_SOURCE_BYTES:
+                    return None
+                data = bytearray()
+                for chunk in response.iter_content(64 * 1024):
+                    data.extend(chunk)
+                    if len(data) > MAX_SOURCE_BYTES:
+                        return None
+                return bytes(data)
+        except requests.RequestException as e:
+            print(f"Thumbnail source {url} failed: {e}")
+            return None
+
+    def render(self, image):
+        """Returns the encoded thumbnail of an image, None if it can't be made."""
+        url = image.variant_url(self.width)
+        if url.split("?")[0].lower().endswith(VIDEO_EXTENSIONS):
+            return None
+        source = self.fetch(url)
+        if source is None:
+            return None
+        try:
+            with PILImage.open(io.BytesIO(source)) as picture:
+                # Animated images are thumbnailed from their first frame.
+                picture.seek(0)
+                picture = ImageOps.exif_transpose(picture)
+                picture.thumbnail((self.width, self.width * 2), PILImage.LANCZOS)
+                if self.format == "jpeg" or picture.mode not in ("RGB", "RGBA"):
+                    picture = picture.convert(
+                        "RGBA"
+                        if self.format == "webp" and "A" in picture.getbands()
+                        else "RGB"
+                    )
+                out = io.BytesIO()
+                picture.save(out, FORMATS[self.format][0], quality=80)
+                return out.getvalue()
+        except (OSError, ValueError, PILImage.DecompressionBombError) as e:
+            print(f"Thumbnail of {url} failed: {e}")
+            return None
+
+    def write(self, path: str, data: bytes):
+        """Writes a thumbnail atomically, then evicts if the cache is over its cap."""
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp, path)
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        with self.lock:
+            if self.size is None:
+                self.size = self.disk_usage()
+            else:
+                self.size += len(data)
+            over = self.size > self.max_bytes
+        if over:
+            self.evict()
+
+    def files(self) -> list:
+        """Returns (mtime, size, path) of every thumbnail."""
+        found = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, path))
+        return found
+
+    def disk_usage(self) -> int:
+        return sum(size for _, size, _ in self.files())
+
+    def evict(self) -> int:
+        """
+        Deletes the least recently served thumbnails until the cache is back
+        under `EVICT_TO` of its cap.
+        :return: Number of files deleted.
+        """
+        files = sorted(self.files())
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * EVICT_TO
+        deleted = 0
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                ...
+            total -= size
+            deleted += 1
+        with self.lock:
+            self.size = total
+        return deleted
+
+    def generate(self, images, workers: int = 8) -> dict:
+        """
+        Makes the thumbnails an image list doesn't have yet.
+        :return: {"made", "cached", "failed"} counts.
+        """
+        counts = {"made": 0, "cached": 0, "failed": 0}
+
+        def make(image):
+            if os.path.exists(self.path(image)):
+                return "cached"
+            return "made" if self.get(image) else "failed"
+
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="thumbnail"
+        ) as executor:
+            for result in executor.map(make, images):
+                counts[result] += 1
+        return counts
+
+
+_thumbnails = None
+_thumbnails_lock = threading.Lock()
+
+
+def get_thumbnails() -> ThumbnailCache:
+    """Process-wide cache, shared by every request thread."""
+    global _thumbnails
+    with _thumbnails_lock:
+        if _thumbnails is None:
+            _thumbnails = ThumbnailCache()
+        return _thumbnails
@@ -16,11 +16,13 @@ urlpatterns = [
         name="folder_settings",
     ),
     path("gallery/", views.ImageListView.as_view(), name="gallery"),
+    path("gallery/cards/", views.ImageCardsView.as_view(), name="gallery_cards"),
     # Add more URL patterns as needed
     path("settings/", views.MainSettingsView.as_view(), name="settings"),
     path("options/", views.FolderOptionsView.as_view(), name="folder_options"),
     path("saved/", views.SavedImagesView.as_view(), name="saved_images"),
     path("image/<int:pk>/save/", views.ImageSaveView.as_view(), name="image_save"),
+    path("image/<int:pk>/thumb/", views.ThumbnailView.as_view(), name="thumbnail"),
     path("bulk_subs/", views.BulkUploadSubreddits.as_view(), name="bulk_upload"),
     # path('image/<int:pk>/', views.ImageDetailView.as_view(), name='image_detail'),
     # path('upload/', views.ImageUploadView.as_view(), name='image_upload'),
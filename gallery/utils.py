@@ -1,17 +1,25 @@
-import time
 from django.conf import settings
-import praw
-import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from django.db import transaction
-from .models import IgnoredPosts, SubReddit, Post, Gallery, Image, reset_connection_pool
-from django.db.utils import OperationalError
-from icecream import ic
-
-import urllib.parse
+from .membership import KnownPosts
+from .models import (
+    IgnoredPosts,
+    SubReddit,
+    Post,
+    Gallery,
+    Image,
+    ImageCounter,
+    SyncJob,
+)
+from django.db.models import Count, F, Max
+from django.utils import timezone
+from .clients import ClientPool
+from .listing import about_request, listing_request, parse_about, parse_listing
+from .scheduler import plan_sync
+from .telemetry import record
+from .validation import get_validator
 
 LIMIT = 1000
-workers = 5
+PAGE_SIZE = 100  # Reddit returns listings 100 posts at a time
 reddit_link = "https://www.reddit.com"
 BASE_DIR = settings.BASE_DIR
 
@@ -29,15 +37,32 @@ type_ = [
 ]
 
 
-def reddit_client():
-    return praw.Reddit(
-        client_id=settings.CLIENT_ID,
-        client_secret=settings.CLIENT_SECRET,
-        user_agent=settings.USER_AGENT,
-    )
+# Every registered Reddit app of the process, shared by every fetch thread.
+client_pool = ClientPool()
+
+
+def set_request_budget(requests_per_minute: int):
+    """Sets each app's local budget, e.g. to a worker process's share of it."""
+    client_pool.set_per_minute(requests_per_minute)
+
+
+def get_client():
+    """
+    Returns the current thread's client for the registered app with the most
+    headroom, see `clients.ClientPool`.
+    PRAW isn't thread safe, so every fetch thread gets its own clients.
+    """
+    return client_pool.client()
 
 
-client = reddit_client()
+def get_listings():
+    """Yields every (time frame, listing type) pair a sync fetches."""
+    for time_ in time_frames:
+        for type_of in type_:
+            if type_of in ["hot", "new"]:
+                if time_ != "day":
+                    continue
+            yield time_, type_of
 
 
 def get_gallery_images(post):
@@ -63,61 +88,86 @@ def get_gallery_images(post):
     return media_data
 
 
-def get_subreddit_info(
-    subreddit: str, time_frame: str, type_: str, limit: int = LIMIT
-) -> list:
+def submission_to_dict(post) -> dict:
+    """
+    Builds a post dict from a PRAW `Submission`.
+    Reference for `listing.parse_post`, which `bench_parse` compares it against.
+    """
+    data = {
+        "title": post.title,
+        "content": post.selftext,
+        "id": post.id,
+        "score": post.score,
+        "author": post.author or "[deleted]",
+        # "comments": post.num_comments,
+        "url": post.url,
+        "perma_url": f"{reddit_link}/{post.permalink}",
+        "created": post.created_utc,
+    }
     try:
-        if "u/" in subreddit:
-            sub_data = client.redditor("" + subreddit.split("u/")[-1])
-            if type_ == "top":
-                all_posts = sub_data.submissions.top(time_filter=time_frame, limit=limit)
-            elif type_ == "hot":
-                all_posts = sub_data.submissions.hot(limit=limit)
-            elif type_ == "new":
-                all_posts = sub_data.submissions.new(limit=limit)
-
-            posts = list()
-            posts.append(
-                {
-                    "title_sub": sub_data.fullname,
-                    "display_name": sub_data.name,
-                }
-            )
+        if post.url.__contains__("gallery"):
+            data["media_meta"] = get_gallery_images(post)
+    except Exception:
+        ...
+    return data
 
-        else:
-            sub_data = client.subreddit(f"{subreddit}")  # * minus the "r/"
 
-            if type_ == "top":
-                all_posts = sub_data.top(time_filter=time_frame, limit=limit)
-            elif type_ == "hot":
-                all_posts = sub_data.hot(limit=limit)
-            elif type_ == "new":
-                all_posts = sub_data.new(limit=limit)
+def get_subreddit_about(subreddit: str) -> dict:
+    """Fetches the info that leads `get_subreddit_info`'s output."""
+    about = get_client().request(method="GET", path=about_request(subreddit))
+    return parse_about(subreddit, about)
 
-            posts = list()
-            posts.append(
-                {
-                    "title_sub": sub_data.title,
-                    "display_name": sub_data.display_name,
-                }
-            )
-        for post in all_posts:
-            data = {
-                "title": post.title,
-                "content": post.selftext,
-                "id": post.id,
-                "score": post.score,
-                "author": post.author or "[deleted]",
-                # "comments": post.num_comments,
-                "url": post.url,
-                "perma_url": f"{reddit_link}/{post.permalink}",
-            }
-            try:
-                if post.url.__contains__("gallery"):
-                    data["media_meta"] = get_gallery_images(post)
-            except Exception:
-                ...
-            posts.append(data)
+
+def iter_listing_pages(
+    subreddit: str, time_frame: str, type_: str, limit: int = LIMIT, since: float = None
+):
+    """
+    Yields one listing of a subreddit or user a page of post dicts at a time.
+    The next page is only requested once the consumer asks for it, and the
+    client is looked up per request, so the generator can be resumed from any
+    fetch thread.
+    :param since: `created_utc` of the newest post seen by the last sync of this
+        listing. "new" stops at the first post older than it, the other listings
+        stop after a page that held nothing newer.
+    """
+    after = None
+    fetched = 0
+    while fetched < limit:
+        path, params = listing_request(
+            subreddit, time_frame, type_, min(PAGE_SIZE, limit - fetched), after
+        )
+        page, after = parse_listing(
+            get_client().request(method="GET", path=path, params=params)
+        )
+        fetched += len(page)
+        kept = []
+        page_has_new = False
+        for post in page:
+            if since is not None:
+                if post["created"] > since:
+                    page_has_new = True
+                elif type_ == "new":
+                    yield kept
+                    return
+            kept.append(post)
+        yield kept
+        if not page or after is None:
+            return
+        if since is not None and not page_has_new:
+            return
+
+
+def get_subreddit_info(
+    subreddit: str, time_frame: str, type_: str, limit: int = LIMIT, since: float = None
+) -> list:
+    """
+    Fetches one whole listing of a subreddit or user, see `iter_listing_pages`.
+    :return: Subreddit info followed by post dicts, None if the fetch failed.
+    """
+    try:
+        posts = [get_subreddit_about(subreddit)]
+        for page in iter_listing_pages(subreddit, time_frame, type_, limit, since):
+            posts.extend(page)
         return posts
     except Exception as E:
         print("Error fetching subreddit info:", E)
@@ -174,6 +224,7 @@ def clean_list(download_urls: list):
                             "print_url": cleaned_url["print_url"],
                             "reddit_id": download_urls["id"],
                             "gallery": True,
+                            "preview": item.get("preview"),
                         }
                     )
     else:
@@ -186,295 +237,207 @@ def clean_list(download_urls: list):
                     "print_url": cleaned_url["print_url"],
                     "reddit_id": download_urls["url"],
                     "gallery": False,
+                    "preview": download_urls.get("preview"),
                 }
             )
     return cleaned
 
 
-def check_if_good_image(url, retry=0, filename=""):
-    """
-    Checks if the URL is a valid image URL.
-    :param url: The URL to check.
-    :return: True if the URL is a valid image, False otherwise.
+def validate_images(posts: list) -> dict:
     """
-    if filename is None or filename == "":
-        return False
-    try:
-        headers = {
-            "User-Agent": "PostmanRuntime/7.46.1",
-            # "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-            # "Accept-Language": "en-US,en;q=0.5",
-            "Connection": "keep-alive",
-        }
-        if url.__contains__("imgur"):
-            return False
-        response = requests.head(url, timeout=10, headers=headers)
-        # ic(response.headers)
-        if response.status_code not in [200, 307]:
-            ic(response.status_code, url, response.headers.get("Content-Type", ""))
-            return False
-        if response.status_code == 307:
-            if "Location" in response.headers:
-                new_url = urllib.parse.unquote(response.headers["Location"])
-                if retry < 3:
-                    retry += 1
-                    return check_if_good_image(new_url, retry)
-                return False
-        content_type = response.headers.get("Content-Type", "")
-        return content_type.startswith("image/")
-    except requests.ConnectionError:
-        return True
-    except requests.Timeout as E:
-        print("Request timed out", E)
-        return False
-    except requests.RequestException as E:
-        print("Request Failed", E)
-        return False
-
-
-def write_posts(posts: list, sub_reddit: SubReddit):
-    """
-    Writes posts to the database.
-    :param posts: List of posts to write.
-    :param sub_reddit: SubReddit object to associate with the posts.
+    Cleans the image URLs of the posts and validates all of them in one batch.
+    :param posts: Post dicts as returned by `get_subreddit_info`.
+    :return: Dict of url -> True if the URL is a valid image.
     """
+    urls = [
+        item["url"]
+        for post_data in posts
+        for item in clean_list(post_data)
+        if item["filename"]
+    ]
+    return get_validator().validate_many(urls)
+
+
+def known_post_ids(post_ids: list) -> set:
+    """Returns the ids that are already stored or ignored."""
+    ignored = IgnoredPosts.objects.filter(reddit_id__in=post_ids).values_list(
+        "reddit_id", flat=True
+    )
+    existing = Post.objects.filter(reddit_id__in=post_ids).values_list(
+        "reddit_id", flat=True
+    )
+    return set(ignored) | set(existing)
 
-    @transaction.atomic
-    def create_images(post_data, post, sub_reddit):
-        cleaned = clean_list(post_data)
-        # ic(cleaned)
-        if cleaned:
-            for item in cleaned:
-                if item["reddit_id"].__contains__("/"):
-                    item["reddit_id"] = item["reddit_id"].split("/")[-1]
-                if not check_if_good_image(item["url"], filename=item["filename"]):
-                    try:
-                        ignored = IgnoredPosts.objects.create(
-                            reddit_id=post_data["id"]
-                        )
-                    except ValueError as e:
-                        print(f"ValueError: {e}")
-                try:
-                    images = Image.objects.filter(
-                        reddit_id=item["reddit_id"],
-                        link=item["url"],
-                        subreddit=sub_reddit,
-                    )
-                    if images.exists() and images.count() > 1:
-                        images.delete()
-                    with transaction.atomic():
-                        image, created = Image.objects.get_or_create(
-                            reddit_id=item["reddit_id"],
-                            subreddit=sub_reddit,
-                            link=item["url"],
-                            post_ref=post,
-                        )
-                        if created and item["gallery"]:
-                            gallery, _ = Gallery.objects.get_or_create(
-                                reddit_id=item["reddit_id"],
-                                subreddit=sub_reddit,
-                                link=post_data["url"],
-                                post_ref=post,
-                            )
-                            image.gallery = gallery
-                            image.save()
-                except Exception as e:
-                    print(f"Exception: {e}, {item['print_url']}")
-                    break
-
-    @transaction.atomic
-    def create_posts(post_data, sub_reddit):
-        """Creates or updates a post in the database."""
-        if IgnoredPosts.objects.filter(reddit_id=post_data["id"]).exists():
-            return
-        try:
-            # ic(post_data) if "media_meta" in post_data.keys() else None
-            post, created = Post.objects.get_or_create(
-                reddit_id=post_data["id"],
-                defaults={
-                    "title": post_data["title"],
-                    "content": post_data["content"],
-                    "link": post_data["perma_url"],
-                    "score": post_data["score"],
-                    "author": post_data.get("author", ""),
-                    "subreddit": sub_reddit,
-                },
-            )
-            if created:
-                create_images(post_data, post, sub_reddit)
-
-        except Exception as e:
-            print(
-                f"Exception: {e}, objects {Post.objects.filter(reddit_id=post_data['id'])}"
-            )
-            Post.objects.filter(reddit_id=post_data["id"]).delete()
-            return
-    with ThreadPoolExecutor(max_workers=workers) as executor:
-        future_to_url = {
-            executor.submit(create_posts, post_data, sub_reddit): post_data["id"]
-            for post_data in posts
-        }
-        for future in as_completed(future_to_url):
-            future.result()
-    # for post in posts:
-    # create_posts(post, sub_reddit)
-
-
-###################### BULKING AND SOMETHING ######################
 
-# Even Simpler Alternative - Individual processing with bulk benefits
-def write_posts_hybrid(posts: list, sub_reddit: SubReddit):
+def prepare_posts(posts: list, known: KnownPosts = None) -> list:
     """
-    Hybrid approach: Bulk create posts, individual image processing.
+    First ingestion stage: drops known posts, then cleans and validates the
+    images of the rest. Does all of its network I/O outside any transaction.
+    :param posts: Post dicts as returned by `get_subreddit_info`.
+    :param known: Preloaded ids of the sync, the database is asked without it.
+    :return: List of {"post": post dict, "images": cleaned, valid images}.
     """
-
-    @transaction.atomic
-    def process_post_batch(posts_batch, sub_reddit):
-        """Bulk create posts, then process images individually"""
-        if not posts_batch:
+    if known is None:
+        known = known_post_ids([post_data["id"] for post_data in posts])
+    fresh = [post_data for post_data in posts if post_data["id"] not in known]
+    verdicts = validate_images(fresh)
+    # One oversized link would fail the whole bulk insert of its page.
+    max_link = Image._meta.get_field("link").max_length
+    prepared = []
+    for post_data in fresh:
+        images = []
+        for item in clean_list(post_data):
+            if not verdicts.get(item["url"], False) or len(item["url"]) > max_link:
+                continue
+            if "/" in item["reddit_id"]:
+                item["reddit_id"] = item["reddit_id"].split("/")[-1]
+            images.append(item)
+        prepared.append({"post": post_data, "images": images})
+    return prepared
+
+
+def commit_posts(prepared: list, sub_reddit: SubReddit, known: KnownPosts = None):
+    """
+    Second ingestion stage: writes one page of prepared posts in a single short
+    transaction, with a fixed number of queries however many posts and images
+    the page holds. Posts without a valid image are ignored from then on.
+    :param prepared: Output of `prepare_posts`.
+    :param sub_reddit: SubReddit object to associate with the posts.
+    :param known: Preloaded ids of the sync, the page's ids are added once committed.
+    """
+    write_page(prepared, sub_reddit)
+    if known is not None:
+        known.update(entry["post"]["id"] for entry in prepared)
+
+
+def write_page(prepared: list, sub_reddit: SubReddit):
+    ignored = [
+        IgnoredPosts(reddit_id=entry["post"]["id"])
+        for entry in prepared
+        if not entry["images"]
+    ]
+    entries = [entry for entry in prepared if entry["images"]]
+    record("posts_ignored", len(ignored))
+    record("posts_new", len(entries))
+    # Rows handed to the inserts, conflicts ignored by the database included.
+    record("rows_inserted", len(ignored))
+    with transaction.atomic():
+        IgnoredPosts.objects.bulk_create(ignored, ignore_conflicts=True)
+        if not entries:
             return
-
-        post_ids = [post["id"] for post in posts_batch]
-
-        # Filter out ignored and existing posts
-        ignored_ids = set(
-            IgnoredPosts.objects.filter(reddit_id__in=post_ids).values_list(
-                "reddit_id", flat=True
-            )
+        started = timezone.now()
+        Post.objects.bulk_create(
+            [
+                Post(
+                    reddit_id=entry["post"]["id"],
+                    title=entry["post"]["title"],
+                    content=entry["post"]["content"],
+                    link=entry["post"]["perma_url"],
+                    score=entry["post"]["score"],
+                    author=entry["post"].get("author", ""),
+                    author_url=Post.build_author_url(entry["post"].get("author", "")),
+                    subreddit=sub_reddit,
+                )
+                for entry in entries
+            ],
+            ignore_conflicts=True,
         )
-
-        existing_ids = set(
-            Post.objects.filter(reddit_id__in=post_ids).values_list(
-                "reddit_id", flat=True
-            )
+        # ignore_conflicts leaves the pks unset, read them back in one go.
+        post_ids = dict(
+            Post.objects.filter(
+                reddit_id__in=[entry["post"]["id"] for entry in entries]
+            ).values_list("reddit_id", "id")
         )
-
-        valid_posts = [
-            p
-            for p in posts_batch
-            if p["id"] not in ignored_ids and p["id"] not in existing_ids
+        gallery_posts = [
+            entry
+            for entry in entries
+            if any(item["gallery"] for item in entry["images"])
         ]
-
-        if not valid_posts:
-            return
-
-        # ic(valid_posts)
-        # Bulk create posts
-        posts_to_create = []
-        for post_data in valid_posts:
-            posts_to_create.append(
-                Post(
-                    reddit_id=post_data["id"],
-                    title=post_data["title"],
-                    content=post_data["content"],
-                    link=post_data["perma_url"],
-                    score=post_data["score"],
+        gallery_ids = {}
+        record(
+            "rows_inserted",
+            len(entries)
+            + len(gallery_posts)
+            + sum(len(entry["images"]) for entry in entries),
+        )
+        if gallery_posts:
+            Gallery.objects.bulk_create(
+                [
+                    Gallery(
+                        reddit_id=entry["post"]["id"],
+                        subreddit=sub_reddit,
+                        link=entry["post"]["url"],
+                        post_ref_id=post_ids[entry["post"]["id"]],
+                    )
+                    for entry in gallery_posts
+                ],
+                ignore_conflicts=True,
+            )
+            gallery_ids = dict(
+                Gallery.objects.filter(
+                    reddit_id__in=[entry["post"]["id"] for entry in gallery_posts],
                     subreddit=sub_reddit,
-                )
+                ).values_list("reddit_id", "id")
             )
-
-        i = 1
-        while i < 6:
-            try:
-                Post.objects.bulk_create(posts_to_create)
-                break
-            except OperationalError as e:
-                if "database is locked" in str(e):
-                    wait_time = 2 * i
-                    print(f"Database locked, retrying in {wait_time}s...")
-                    time.sleep(wait_time)
-                    i += 1
-                    continue
-                else:
-                    print(f"Failed after {i} attempts: {e}")
-                    break
-        # end while
-
-        # Process images for each post individually (avoids bulk_update issues)
-        for post_data in valid_posts:
-            process_post_images(post_data, sub_reddit)
-
-    def process_post_images(post_data, sub_reddit):
-        """Process images for a single post"""
-        try:
-            # Get the post we just created
-            post = Post.objects.get(reddit_id=post_data["id"])
-            cleaned_images = clean_list(post_data)
-
-            if not cleaned_images:
-                return
-
-            for item in cleaned_images:
-                reddit_id = item["reddit_id"]
-                if "/" in reddit_id:
-                    reddit_id = reddit_id.split("/")[-1]
-
-                if not check_if_good_image(item["url"]):
-                    IgnoredPosts.objects.get_or_create(reddit_id=post_data["id"])
-                    continue
-
-                # Create image
-                image, created = Image.objects.get_or_create(
-                    reddit_id=reddit_id,
+        Image.objects.bulk_create(
+            [
+                Image(
+                    reddit_id=item["reddit_id"],
                     subreddit=sub_reddit,
                     link=item["url"],
-                    defaults={"post_ref": post},
+                    width=(item["preview"] or {}).get("width"),
+                    height=(item["preview"] or {}).get("height"),
+                    variants=(item["preview"] or {}).get("variants", []),
+                    post_ref_id=post_ids[entry["post"]["id"]],
+                    gallery_id=(
+                        gallery_ids.get(entry["post"]["id"]) if item["gallery"] else None
+                    ),
                 )
-
-                # Handle gallery
-                if item.get("gallery", False):
-                    gallery, _ = Gallery.objects.get_or_create(
-                        reddit_id=reddit_id,
-                        subreddit=sub_reddit,
-                        link=post_data["url"],
-                        defaults={"post_ref": post},
-                    )
-                    image.gallery = gallery
-                    image.save()
-
-        except Exception as e:
-            print(f"Error processing images for post {post_data['id']}: {e}")
-
-    # with ThreadPoolExecutor(max_workers=workers) as executor:
-    #     future_to_url = {
-    #         executor.submit(process_post_batch, post_data, sub_reddit): post_data["id"]
-    #         for post_data in posts
-    #     }
-    #     for future in as_completed(future_to_url):
-    #         future.result()
-
-    # Process in batches
-    batch_size = 20
-    for i in range(0, len(posts), batch_size):
-        batch = posts[i : i + batch_size]
-        process_post_batch(batch, sub_reddit)
+                for entry in entries
+                for item in entry["images"]
+            ],
+            ignore_conflicts=True,
+        )
+        # Conflicts leave no trace either, the page's new images are the ones
+        # added since the insert started.
+        added = Image.objects.filter(
+            subreddit=sub_reddit,
+            post_ref_id__in=post_ids.values(),
+            date_added__gte=started,
+        ).aggregate(images=Count("id"), newest=Max("id"), newest_added=Max("date_added"))
+        ImageCounter.add(
+            sub_reddit, added["images"], added["newest"], added["newest_added"]
+        )
 
 
-######################## END BULKING #########################
+def write_posts(posts: list, sub_reddit: SubReddit, known: KnownPosts = None):
+    """
+    Writes posts to the database, one page at a time.
+    Each page is prepared without holding a transaction, then committed in one.
+    :param posts: List of posts to write.
+    :param sub_reddit: SubReddit object to associate with the posts.
+    :param known: Preloaded `KnownPosts` of the sync, if there is one.
+    """
+    for i in range(0, len(posts), PAGE_SIZE):
+        prepared = prepare_posts(posts[i : i + PAGE_SIZE], known)
+        commit_posts(prepared, sub_reddit, known)
 
 
 def get_posts(subreddit: SubReddit):
-    for time_ in time_frames:
-        for type_of in type_:
-            if type_of in ["hot", "new"]:
-                if time_ != "day":
-                    continue
+    """
+    Fetches every listing of one subreddit concurrently and writes them.
+    :param subreddit: SubReddit object to sync.
+    """
+    from .fetcher import run_sync
 
-            print("processed subreddit: ", subreddit.sub_reddit, time_, type_of)
-            posts = get_subreddit_info(subreddit.sub_reddit, time_, type_of)
-            try:
-                subreddit.display_name = posts[0]["title_sub"]
-                subreddit.name = posts[0]["display_name"]
-                subreddit.save()
-            except Exception:
-                pass
-            if posts:
-                write_posts(posts[1:], subreddit)
-                reset_connection_pool()
+    run_sync([subreddit])
 
 
 def sync_data_with_json(json_data):
+    from .fetcher import run_sync
+
     if isinstance(json_data, list):
+        subreddits = []
         for sub in json_data:
             sub_red, created = SubReddit.objects.get_or_create(
                 sub_reddit=sub,
@@ -484,17 +447,24 @@ def sync_data_with_json(json_data):
                     "is_active": True,
                 },
             )
-            get_posts(sub_red)
+            subreddits.append(sub_red)
+        run_sync(subreddits)
 
 
-def sync_data():
+def sync_data(budget: float = None, everything: bool = False):
     """
     Syncs data from the Reddit API to the local database.
     This function should be called periodically to keep the database updated.
+    Subreddits are synced in order of expected new posts, the quiet ones only
+    once they're due, see `scheduler.plan_sync`.
+    :param budget: Seconds the sync may take, None for no limit.
+    :param everything: Sync every active subreddit, due or not.
     """
-    subreddits = SubReddit.objects.filter(is_active=True).order_by("-id")
-    for subreddit in subreddits:
-        get_posts(subreddit)
+    from .fetcher import run_sync
+
+    subreddits = plan_sync(SubReddit.objects.filter(is_active=True), everything)
+    print(f"Syncing {len(subreddits)} subreddits")
+    return run_sync(subreddits, budget=budget)
 
 
 def sync_singular(sub: SubReddit):
@@ -503,3 +473,31 @@ def sync_singular(sub: SubReddit):
     :param sub: SubReddit object to sync.
     """
     get_posts(sub)
+
+
+def run_sync_job(job: SyncJob):
+    """
+    Runs a claimed SyncJob, keeping its progress counters up to date.
+    :param job: SyncJob returned by `SyncJob.claim`.
+    """
+    from .fetcher import run_sync
+
+    def subreddit_done(subreddit):
+        SyncJob.objects.filter(pk=job.pk).update(
+            done_subreddits=F("done_subreddits") + 1
+        )
+
+    try:
+        subreddits = list(job.get_subreddits())
+        job.total_subreddits = len(subreddits)
+        job.save(update_fields=["total_subreddits"])
+        stats = run_sync(subreddits, on_subreddit_done=subreddit_done, job=job)
+        job.refresh_from_db(fields=["done_subreddits"])
+        job.posts_fetched = stats["posts_fetched"]
+        job.state = SyncJob.DONE
+    except Exception as e:
+        print(f"Sync job {job.pk} failed: {e}")
+        job.error = str(e)
+        job.state = SyncJob.FAILED
+    job.finished_on = timezone.now()
+    job.save(update_fields=["posts_fetched", "state", "error", "finished_on"])
@@ -0,0 +1,215 @@
+"""
+Image URL validation engine.
+HEAD requests go through one pooled `requests.Session`, so connections to the
+image hosts are kept alive between checks instead of paying a TCP+TLS handshake
+per URL. Checks run on a thread pool and every host gets its own concurrency
+limit, so a batch of URLs can be submitted at once without hammering one CDN.
+Definitive answers are stored in `ValidatedUrl`, a URL is only checked over the
+network again once its entry is older than `VALIDATION_CACHE_TTL`.
+"""
+
+import hashlib
+import threading
+import urllib.parse
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+from icecream import ic
+from requests.adapters import HTTPAdapter
+
+from .models import ValidatedUrl
+from .telemetry import record
+
+HEADERS = {
+    "User-Agent": "PostmanRuntime/7.46.1",
+    "Connection": "keep-alive",
+}
+MAX_REDIRECTS = 3
+CACHE_BATCH = 1000
+
+
+def normalize_url(url: str) -> str:
+    """Lowercases scheme and host and drops the fragment."""
+    parts = urllib.parse.urlsplit(url.strip())
+    return urllib.parse.urlunsplit(
+        (parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, "")
+    )
+
+
+def url_hash(url: str) -> str:
+    return hashlib.sha256(normalize_url(url).encode()).hexdigest()
+
+
+class ImageValidator:
+    def __init__(self, workers: int = None, per_host: int = None, timeout: int = 10):
+        self.workers = workers or settings.VALIDATION_WORKERS
+        self.per_host = per_host or settings.VALIDATION_PER_HOST
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=64, pool_maxsize=self.workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="validate"
+        )
+        self.host_limits = {}
+        self.lock = threading.Lock()
+
+    def host_limit(self, url: str) -> threading.BoundedSemaphore:
+        host = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            if host not in self.host_limits:
+                self.host_limits[host] = threading.BoundedSemaphore(self.per_host)
+            return self.host_limits[host]
+
+    def head(self, url: str) -> requests.Response:
+        with self.host_limit(url):
+            return self.session.head(url, timeout=self.timeout, allow_redirects=False)
+
+    def probe(self, url: str) -> dict:
+        """
+        Checks if the URL is a valid image URL over the network.
+        307s are followed up to `MAX_REDIRECTS` times, hosts that can't be
+        reached are given the benefit of the doubt.
+        :param url: The URL to check.
+        :return: Dict with is_good, status_code, content_type, redirect_to,
+            cacheable, False for answers that shouldn't outlive this run, and
+            requests, the HEAD requests it took.
+        """
+        result = {
+            "is_good": False,
+            "status_code": None,
+            "content_type": "",
+            "redirect_to": "",
+            "cacheable": True,
+            "requests": 0,
+        }
+        if "imgur" in url:
+            return result
+        try:
+            for _ in range(MAX_REDIRECTS + 1):
+                result["requests"] += 1
+                response = self.head(url)
+                result["status_code"] = response.status_code
+                result["content_type"] = response.headers.get("Content-Type", "")
+                if response.status_code not in [200, 307]:
+                    ic(response.status_code, url, result["content_type"])
+                    return result
+                if response.status_code == 307 and "Location" in response.headers:
+                    url = urllib.parse.urljoin(
+                        url, urllib.parse.unquote(response.headers["Location"])
+                    )
+                    result["redirect_to"] = url
+                    continue
+                result["is_good"] = result["content_type"].startswith("image/")
+                return result
+            return result
+        except requests.ConnectionError:
+            return {**result, "is_good": True, "cacheable": False}
+        except requests.Timeout as E:
+            print("Request timed out", E)
+            return {**result, "cacheable": False}
+        except requests.RequestException as E:
+            print("Request Failed", E)
+            return {**result, "cacheable": False}
+
+    def check(self, url: str) -> bool:
+        """
+        Checks if the URL is a valid image URL, using the cache when it can.
+        :param url: The URL to check.
+        :return: True if the URL is a valid image, False otherwise.
+        """
+        return self.validate_many([url])[url]
+
+    def submit(self, url: str) -> Future:
+        """Queues one URL for the network, the future resolves to `probe`'s result."""
+        return self.executor.submit(self.probe, url)
+
+    def cached(self, urls: set) -> dict:
+        """Returns url -> is_good for the URLs with a fresh cache entry."""
+        ttl = settings.VALIDATION_CACHE_TTL
+        if ttl <= 0:
+            return {}
+        # Spellings of one image (host case, a #fragment) share an entry.
+        hashes = {}
+        for url in urls:
+            hashes.setdefault(url_hash(url), []).append(url)
+        fresh_after = timezone.now() - timedelta(seconds=ttl)
+        verdicts = {}
+        keys = list(hashes)
+        for i in range(0, len(keys), CACHE_BATCH):
+            entries = ValidatedUrl.objects.filter(
+                url_hash__in=keys[i : i + CACHE_BATCH], checked_at__gte=fresh_after
+            ).values_list("url_hash", "is_good")
+            for key, is_good in entries:
+                for url in hashes[key]:
+                    verdicts[url] = is_good
+        return verdicts
+
+    def store(self, results: dict):
+        """Upserts the cacheable results of a batch."""
+        if settings.VALIDATION_CACHE_TTL <= 0:
+            return
+        now = timezone.now()
+        # Keyed on the hash, one upsert can't touch the same row twice.
+        entries = {
+            url_hash(url): ValidatedUrl(
+                url_hash=url_hash(url),
+                url=normalize_url(url),
+                status_code=result["status_code"],
+                content_type=result["content_type"][:255],
+                redirect_to=result["redirect_to"],
+                is_good=result["is_good"],
+                checked_at=now,
+            )
+            for url, result in results.items()
+            if result["cacheable"]
+        }
+        ValidatedUrl.objects.bulk_create(
+            list(entries.values()),
+            batch_size=CACHE_BATCH,
+            update_conflicts=True,
+            unique_fields=["url_hash"],
+            update_fields=[
+                "url",
+                "status_code",
+                "content_type",
+                "redirect_to",
+                "is_good",
+                "checked_at",
+            ],
+        )
+
+    def validate_many(self, urls) -> dict:
+        """
+        Checks a batch of URLs, only the ones without a fresh cache entry go
+        to the network, concurrently.
+        :param urls: Iterable of URLs, duplicates are checked once.
+        :return: Dict of url -> True if the URL is a valid image.
+        """
+        urls = set(urls)
+        verdicts = self.cached(urls)
+        record("cache_hits", len(verdicts))
+        futures = {url: self.submit(url) for url in urls if url not in verdicts}
+        results = {url: future.result() for url, future in futures.items()}
+        record("head_requests", sum(result["requests"] for result in results.values()))
+        self.store(results)
+        verdicts.update({url: result["is_good"] for url, result in results.items()})
+        return verdicts
+
+
+_validator = None
+_validator_lock = threading.Lock()
+
+
+def get_validator() -> ImageValidator:
+    """Returns the validator shared by the whole process."""
+    global _validator
+    with _validator_lock:
+        if _validator is None:
+            _validator = ImageValidator()
+        return _validator
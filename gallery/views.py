@@ -1,13 +1,14 @@
 import os
 import requests
 import json
+from urllib.parse import urlencode
 
 from collections import OrderedDict
 from django.db import OperationalError, transaction
 from django.db.models.manager import BaseManager
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
-from django.db.models import Q
+from django.db.models import Prefetch, Q
 
 # Create your views here.
 from django.views.generic import (
@@ -17,52 +18,119 @@ from django.views.generic import (
     CreateView,
 )
 from django.http import (
+    FileResponse,
+    Http404,
     HttpResponse,
     JsonResponse,
 )
 
+from .caching import FOLDERS, IMAGES, cached_response, get_version, subreddit_scope
 from .forms import SettingsForm, SubRedditForm, SubSettingsForm
 
 from .models import (
     Category,
     IgnoredPosts,
     Image,
+    ImageCounter,
     MainSettings,
     Post,
     SubReddit,
     SavedImages,
     Gallery,
+    SyncJob,
+    SyncRun,
 )
-from .utils import sync_data, sync_singular, check_if_good_image
+from .pagination import keyset_page
+from .thumbnails import get_thumbnails
+from .validation import get_validator
 from icecream import ic
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import time
 
 workers = 10
+# The clean action checks and deletes images this many at a time.
+CLEAN_CHUNK = 500
 
 
 def get_settings() -> MainSettings:
     return MainSettings.get_or_create_settings()
 
 
+# What a card in `gallery_cards.html` shows. Every foreign key of Image is
+# nullable, so they're joined by name, a bare `select_related()` skips them.
+CARD_RELATIONS = ("post_ref", "subreddit", "gallery__subreddit")
+CARD_FIELDS = (
+    "id",
+    "link",
+    "date_added",
+    "post_ref__title",
+    "post_ref__score",
+    "post_ref__author",
+    "post_ref__author_url",
+    "subreddit__sub_reddit",
+    "gallery__link",
+    # `Gallery.__str__` shows its subreddit.
+    "gallery__subreddit__sub_reddit",
+    "gallery__subreddit__is_active",
+    "gallery__subreddit__excluded",
+)
+
+
+def gallery_images(category_name: str = "", subreddit: SubReddit = None):
+    """
+    Images shown by a gallery page, unordered, see `pagination.keyset_page`.
+    Loads what a card shows in the same query and nothing else.
+    :param category_name: Only the subreddits of this category.
+    :param subreddit: Only this subreddit, wins over the category.
+    """
+    images = Image.objects.select_related(*CARD_RELATIONS).only(*CARD_FIELDS)
+    if subreddit is not None:
+        return images.filter(subreddit=subreddit)
+    if category_name != "":
+        category = Category.objects.filter(name=category_name).first()
+        if category:
+            return images.filter(subreddit__in=category.subs)
+    return images.exclude(subreddit__excluded=True)
+
+
+def cards_url(cursor: str, category_name: str = "", subreddit: SubReddit = None):
+    """URL of the cards that follow a page, None after the last page."""
+    if cursor is None:
+        return None
+    params = {"after": cursor}
+    if subreddit is not None:
+        params["sub"] = subreddit.pk
+    elif category_name:
+        params["category"] = category_name
+    return f"{reverse('gallery_cards')}?{urlencode(params)}"
+
+
 class FolderOnlyView(DetailView):
     model = SubReddit
     template_name = "gallery.html"
 
+    def get(self, request, *args, **kwargs):
+        return cached_response(
+            request,
+            [subreddit_scope(kwargs["pk"]), FOLDERS],
+            lambda: super(FolderOnlyView, self).get(request, *args, **kwargs),
+            per_user=True,
+        )
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        subreddit: SubReddit = self.get_object()
-        images = (
-            Image.objects.filter(subreddit=subreddit)
-            .select_related()
-            .order_by("-date_added")
+        subreddit: SubReddit = self.object
+        images, cursor = keyset_page(
+            gallery_images(subreddit=subreddit), self.request.GET.get("after")
         )
-        context["total_images"] = images.count()
-        context["newest_image"] = Image.objects.order_by("-date_added").first()
+        totals = ImageCounter.totals([subreddit])
+        context["total_images"] = totals["images"]
+        context["newest_image"] = totals["newest_image"]
         context["subs"] = SubReddit.objects.all()
         context["active_sub"] = subreddit.sub_reddit
         context["the_sub"] = subreddit
         context["images"] = images
+        context["next_page"] = cards_url(cursor, subreddit=subreddit)
         return context
 
 
@@ -70,38 +138,66 @@ class ImageListView(ListView):
     model = Image
     template_name = "gallery.html"
     context_object_name = "images"
-    paginate_by = 2000  # Optional pagination
+
+    def get(self, request, *args, **kwargs):
+        return cached_response(
+            request,
+            [IMAGES, FOLDERS],
+            lambda: super(ImageListView, self).get(request, *args, **kwargs),
+            per_user=True,
+        )
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["total_images"] = Image.objects.count()
-        context["newest_image"] = Image.objects.order_by("-date_added").first()
-        if (category := self.request.GET.get("category", "")) == "":
+        category = self.request.GET.get("category", "")
+        images, cursor = keyset_page(self.object_list, self.request.GET.get("after"))
+        context["images"] = images
+        context["next_page"] = cards_url(cursor, category)
+        category_obj = Category.objects.filter(name=category).first() if category else None
+        totals = ImageCounter.totals(category_obj.subs if category_obj else None)
+        context["total_images"] = totals["images"]
+        context["newest_image"] = totals["newest_image"]
+        if category == "":
             context["subs"] = SubReddit.objects.filter(excluded=True)
         else:
-            context["subs"] = SubReddit.objects.filter(categories=Category.objects.filter(name=category).first())
+            context["subs"] = SubReddit.objects.filter(categories=category_obj)
         context["categories"] = Category.get_all_categories()
         context["category_name"] = category
         return context
 
     def get_queryset(self):
-        if self.request.GET.get("category", "") != "":
-            category_name = self.request.GET.get("category", "")
-            category = Category.objects.filter(name=category_name).first()
-            if category:
-                images = (
-                    Image.objects.select_related()
-                    .filter(subreddit__in=category.subs)
-                    .order_by("-date_added")
-                    .all()
-                )
-                return images
-        return (
-            Image.objects.select_related()
-            .exclude(subreddit__excluded=True)
-            .order_by("-date_added")
-            .all()
+        return gallery_images(self.request.GET.get("category", ""))
+
+
+class ImageCardsView(View):
+    """
+    Next page of gallery cards for the infinite scroll, the URL of the page
+    after it comes in the `X-Next-Page` header.
+    """
+
+    def get(self, request):
+        sub = request.GET.get("sub", "")
+        # Like a bad cursor, a bad subreddit id is the client's mistake, not a 500.
+        if sub and not sub.isdigit():
+            raise Http404("No such subreddit")
+        scope = subreddit_scope(sub) if sub else IMAGES
+        return cached_response(
+            request, [scope, FOLDERS], lambda: self.cards(request, sub)
+        )
+
+    def cards(self, request, sub: str):
+        subreddit = None
+        if sub:
+            subreddit = get_object_or_404(SubReddit, pk=sub)
+        category = request.GET.get("category", "")
+        images, cursor = keyset_page(
+            gallery_images(category, subreddit), request.GET.get("after")
         )
+        response = render(request, "gallery_cards.html", {"images": images})
+        if next_page := cards_url(cursor, category, subreddit):
+            response["X-Next-Page"] = next_page
+        return response
+
 
 class ImageSaveView(View):
     def get(self, request, pk):
@@ -143,6 +239,29 @@ class ImageSaveView(View):
             return HttpResponse(e)
 
 
+class ThumbnailView(View):
+    """
+    Serves an image's local thumbnail, made on the first request. Falls back to
+    the image's Reddit preview when it can't be made, e.g. for videos.
+    """
+
+    def get(self, request, pk):
+        image = get_object_or_404(Image.objects.only("link", "variants"), pk=pk)
+        thumbnails = get_thumbnails()
+        path = thumbnails.get(image)
+        if path is None:
+            return redirect(image.thumbnail_url)
+        try:
+            thumbnail = open(path, "rb")
+        except FileNotFoundError:
+            # Evicted since `get()` returned it.
+            return redirect(image.thumbnail_url)
+        response = FileResponse(thumbnail, content_type=thumbnails.content_type)
+        # The path is keyed by the image link, a thumbnail never changes.
+        response["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+
 class SavedImagesView(ListView):
     model = SavedImages
     template_name = "gallery.html"
@@ -165,10 +284,24 @@ class FolderView(ListView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["total_images"] = Image.objects.count()
+        context["total_images"] = ImageCounter.total()
         context["form"] = SubRedditForm()
-        context["categories"] = Category.objects.all()
-        context["no_category_subs"] = SubReddit.objects.filter(categories__isnull=True)
+        # Evaluated only when the cached category blocks are stale, in three
+        # queries however many categories and subreddits there are.
+        context["categories"] = Category.objects.prefetch_related(
+            Prefetch(
+                "subreddits",
+                queryset=SubReddit.objects.prefetch_related("categories"),
+            )
+        )
+        context["no_category_subs"] = SubReddit.objects.filter(
+            categories__isnull=True
+        ).prefetch_related("categories")
+        context["folders_version"] = get_version(FOLDERS)
+        context["sync_jobs"] = SyncJob.objects.select_related(
+            "subreddit", "category"
+        ).order_by("-id")[:5]
+        context["sync_totals"], context["sync_hotspots"] = SyncRun.summary()
         return context
 
     def get_queryset(self):
@@ -264,38 +397,38 @@ class FolderOptionsView(View):
                 sub_reddit.delete()
                 return redirect("folder_view")
             elif "clean" in data.keys():
-                posts = Post.objects.filter(subreddit=sub_reddit).delete()
-                images = Image.objects.filter(subreddit=sub_reddit).delete()
-                gallerys = Gallery.objects.filter(subreddit=sub_reddit).delete()
+                with transaction.atomic():
+                    posts = Post.objects.filter(subreddit=sub_reddit).delete()
+                    images = Image.objects.filter(subreddit=sub_reddit).delete()
+                    gallerys = Gallery.objects.filter(subreddit=sub_reddit).delete()
                 print(
                     f"Deleted {posts[0]} posts, {images[0]} images, {gallerys[0]} gallerys"
                 )
             elif "sync" in data.keys():
+                # Runs on a `sync_worker`, the request returns straight away.
                 if (category := data.get("category", "")) != "":
-                    subs = SubReddit.objects.filter(categories=Category.objects.filter(name=category).first())
-                    print("sub_category:", category, "subs:", subs.count(), "names: ", [sub.sub_reddit for sub in subs])
-                    for sub in subs:
-                        print("Syncing Subreddit:", sub.sub_reddit)
-                        sync_singular(sub)
-                sync_singular(sub_reddit)
+                    category_obj = Category.objects.filter(name=category).first()
+                    if category_obj:
+                        SyncJob.enqueue(category=category_obj)
+                SyncJob.enqueue(subreddit=sub_reddit)
             return redirect("folder_view_detail", pk=pk)
         else:
             if "sync" in data.keys():
+                # Runs on a `sync_worker`, the request returns straight away.
+                category_obj = None
                 if (category := data.get("category", "")) != "":
-                    subs = SubReddit.objects.filter(categories=Category.objects.filter(name=category).first())
-                    print("sub_category:", category, "subs:", subs.count(), "names: ", [sub.sub_reddit for sub in subs])
-                    for sub in subs:
-                        print("Syncing Subreddit:", sub.sub_reddit)
-                        sync_singular(sub)
-                sync_data()
+                    category_obj = Category.objects.filter(name=category).first()
+                SyncJob.enqueue(category=category_obj)
             if "delete" in data.keys():
                 print("deleting posts")
                 i = 0
-                for post_ in Post.objects.all().order_by("-date_added")[:1000]:
-                    i += 1
-                    if i % 50 == 0:
-                        print("Deleted:", i, "/1000", post_)
-                    post_.delete()
+                # One transaction, so the image counters are recounted once.
+                with transaction.atomic():
+                    for post_ in Post.objects.all().order_by("-date_added")[:1000]:
+                        i += 1
+                        if i % 50 == 0:
+                            print("Deleted:", i, "/1000", post_)
+                        post_.delete()
                 return redirect("folder_view")
             if "clear_ignored" in data.keys():
                 ignored = IgnoredPosts.objects.all()
@@ -316,11 +449,11 @@ class FolderOptionsView(View):
                 imgur_images.delete()
                 print("Deleted Imgur images:", imgur_images_count)
                 # Multiple Objects of the same reddit_id can exist, so we need to delete them
-                offset = 0
-                images_all = Image.objects.all().order_by("-date_added")[offset:]
-                image_count = images_all.count() - offset
-                print("Checking images, total:", image_count - offset)
+                images_all = Image.objects.select_related("gallery", "post_ref")
+                image_count = Image.objects.count()
+                print("Checking images, total:", image_count)
                 count = 0
+                verdicts = {}
 
                 # galleries = Gallery.objects.filter(id__in=[gallery.id for gallery in Gallery.objects.all() if gallery.image_set.count() == 2])
                 # post_ref = Post.objects.filter(gallery__in=galleries)
@@ -351,7 +484,7 @@ class FolderOptionsView(View):
                                 if remove_post:
                                     remove_post.delete()
                                 return
-                            elif not check_if_good_image(image.link):
+                            elif not verdicts.get(image.link, False):
                                 image_post = image.post_ref
                                 ic("Bad Image", image_post)
                                 image_post.delete()
@@ -366,16 +499,31 @@ class FolderOptionsView(View):
                             return
 
                 with ThreadPoolExecutor(max_workers=workers) as executor:
-                    futures = [
-                        executor.submit(clean_images, image) for image in images_all
-                    ]
-                    for future in as_completed(futures):
-                        try:
-                            future.result()
-                        except Exception as e:
-                            print("Error cleaning image:", e)
+                    # Only one chunk is held at a time, its links are checked
+                    # in one pooled batch before its images are cleaned. Each
+                    # chunk is its own query, no cursor stays open while the
+                    # workers delete.
+                    chunk, cursor = keyset_page(images_all, size=CLEAN_CHUNK)
+                    while chunk:
+                        verdicts = get_validator().validate_many(
+                            image.link for image in chunk if image.link
+                        )
+                        futures = [
+                            executor.submit(clean_images, image) for image in chunk
+                        ]
+                        for future in as_completed(futures):
+                            try:
+                                future.result()
+                            except Exception as e:
+                                print("Error cleaning image:", e)
+                        if cursor is None:
+                            break
+                        chunk, cursor = keyset_page(
+                            images_all, cursor, size=CLEAN_CHUNK
+                        )
                 # for image in images_all:
                 # clean_images(image)
+                ImageCounter.recount()
         return redirect("folder_view")
 
 